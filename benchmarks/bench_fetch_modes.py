@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Compare the two Pterodactyl fetch modes against a local fake panel:
+servers?include=allocations vs. per-node /allocations.
+
+Usage: python benchmarks/bench_fetch_modes.py [--servers 5000] [--latency 0.02]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main import HttpTransport, PterodactylAPI  # noqa: E402
+from fakes import FakePterodactyl  # noqa: E402
+
+
+def run_mode(panel: FakePterodactyl, mode: str, rounds: int, workers: int):
+    """Fetch all allocations `rounds` times; returns (timings, requests, bytes, allocations)"""
+    timings = []
+    for _ in range(rounds):
+        panel.reset_counters()
+        api = PterodactylAPI(panel.url, 'ptla_benchmark', HttpTransport(max_per_host=workers), workers, mode)
+        started = time.perf_counter()
+        allocations = api.get_allocations()
+        timings.append(time.perf_counter() - started)
+    return timings, panel.total_requests, panel.total_bytes, len(allocations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', type=int, default=5000)
+    parser.add_argument('--allocations', type=int, default=2, help='allocations per server')
+    parser.add_argument('--nodes', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.02, help='simulated latency per request (s)')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+    
+    panel = FakePterodactyl(args.servers, args.allocations, args.nodes, latency=args.latency).start()
+    print(f"Fake panel: {args.servers} servers x {args.allocations} allocations on {args.nodes} nodes, "
+          f"{args.latency * 1000:.0f} ms latency, {args.workers} workers")
+    print(f"{'mode':<10}{'requests':>10}{'bytes':>14}{'allocations':>13}{'median':>10}{'best':>10}")
+    
+    try:
+        for mode in PterodactylAPI.FETCH_MODES:
+            timings, requests, size, allocations = run_mode(panel, mode, args.rounds, args.workers)
+            print(f"{mode:<10}{requests:>10}{size:>14,}{allocations:>13}"
+                  f"{statistics.median(timings):>9.3f}s{min(timings):>9.3f}s")
+    finally:
+        panel.stop()
+
+
+if __name__ == '__main__':
+    main()
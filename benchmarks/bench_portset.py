@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: PortSet (65536-bit bitmap) vs. Python set for the operations
+used by a sync cycle, at 10k and 60k ports.
+
+Usage: python benchmarks/bench_portset.py [--sizes 10000 60000] [--number 50]
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main import PortSet  # noqa: E402
+
+
+def make_sets(size: int, seed: int = 1):
+    """Pterodactyl-like and alias-like port sets that differ in ~1% of the ports"""
+    rng = random.Random(seed)
+    ports = rng.sample(range(1024, 65536), size)
+    alias = set(ports)
+    for port in rng.sample(ports, max(1, size // 100)):
+        alias.discard(port)
+    excluded = {22, 80, 443, 3306, 5432, 6379, 8006, 9090}
+    return set(ports), alias, excluded
+
+
+def operations(ptero, alias, excluded, source):
+    return {
+        'build': lambda: type(ptero)(source),
+        'union': lambda: ptero | alias,
+        'difference': lambda: (ptero - excluded) - alias,
+        'intersection': lambda: ptero & excluded,
+        'sorted iteration': lambda: sorted(ptero) if isinstance(ptero, set) else list(ptero),
+        'len': lambda: len(ptero),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 60000])
+    parser.add_argument('--number', type=int, default=50, help='repetitions per measurement')
+    args = parser.parse_args()
+    
+    print(f"{'ports':>7}  {'operation':<18}{'set (us)':>12}{'PortSet (us)':>15}{'speedup':>10}")
+    for size in args.sizes:
+        ptero, alias, excluded = make_sets(size)
+        # Building starts from a plain list of ints, like the allocation stream
+        source = list(ptero)
+        bitmap_ops = operations(PortSet(ptero), PortSet(alias), PortSet(excluded), source)
+        set_ops = operations(ptero, alias, excluded, source)
+        
+        for name in set_ops:
+            set_time = timeit.timeit(set_ops[name], number=args.number) / args.number * 1e6
+            bitmap_time = timeit.timeit(bitmap_ops[name], number=args.number) / args.number * 1e6
+            print(f"{size:>7}  {name:<18}{set_time:>12.1f}{bitmap_time:>15.1f}{set_time / bitmap_time:>9.1f}x")
+        
+        print(f"{size:>7}  {'memory (bytes)':<18}{sys.getsizeof(ptero):>12}{len(PortSet(ptero).to_bytes()):>15}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of PortMapperSync.sync against local fake Pterodactyl and
+OPNsense servers, at several allocation counts and both alias content shapes.
+
+Every scenario runs three cycles in a fresh worker process:
+  cold      empty alias, full write and reconfigure
+  settle    Pterodactyl unchanged right after a change: alias re-read, no write
+  quiet     Pterodactyl unchanged: alias read skipped
+
+Reported per cycle: wall time, requests and response bytes per upstream (counted
+by the fakes) and the peak RSS of the worker process. The fakes run in the
+parent process, so their memory does not show up in the RSS column.
+
+Usage: python benchmarks/bench_sync.py [--sizes 100 10000 100000] [--shapes dict string]
+"""
+
+import argparse
+import contextlib
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main import HttpTransport, OPNsenseAPI, PortMapperSync, PterodactylAPI, ShardedOPNsenseAPI  # noqa: E402
+from fakes import FakeOPNsense, FakePterodactyl  # noqa: E402
+
+CYCLES = ('cold', 'settle', 'quiet')
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MiB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def sync_worker(conn, panel_url: str, firewall_url: str, fetch_mode: str, workers: int, shards: int,
+                group_by: str):
+    """Run one sync per message received, replying with (outcome, seconds, peak RSS)"""
+    transport = HttpTransport(max_per_host=workers)
+    ptero = PterodactylAPI(panel_url, 'ptla_benchmark', transport, workers, fetch_mode)
+    if shards > 1:
+        opnsense = ShardedOPNsenseAPI(firewall_url, 'key', 'secret', 'pterodactyl_ports', transport=transport,
+                                      shards=shards)
+    else:
+        opnsense = OPNsenseAPI(firewall_url, 'key', 'secret', 'pterodactyl_ports', transport=transport)
+    sync = PortMapperSync(ptero, opnsense, async_reconfigure=False, alias_group_by=group_by)
+    
+    with open(os.devnull, 'w') as devnull:
+        while conn.recv():
+            with contextlib.redirect_stdout(devnull):
+                started = time.perf_counter()
+                outcome = sync.sync()
+                elapsed = time.perf_counter() - started
+            conn.send((outcome, elapsed, peak_rss_mb()))
+
+
+def run_scenario(panel: FakePterodactyl, firewall: FakeOPNsense, args):
+    """Yield (cycle, outcome, seconds, panel counters, firewall counters, RSS) per cycle"""
+    context = multiprocessing.get_context('spawn')
+    parent_conn, child_conn = context.Pipe()
+    worker = context.Process(
+        target=sync_worker,
+        args=(child_conn, panel.url, firewall.url, args.fetch_mode, args.workers, args.shards, args.group_by)
+    )
+    worker.start()
+    try:
+        for cycle in CYCLES:
+            panel.reset_counters()
+            firewall.reset_counters()
+            parent_conn.send(True)
+            outcome, elapsed, rss = parent_conn.recv()
+            yield (cycle, outcome, elapsed,
+                   (panel.total_requests, panel.total_bytes),
+                   (firewall.total_requests, firewall.total_bytes), rss)
+    finally:
+        parent_conn.send(False)
+        worker.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 10000, 100000], help='total allocations')
+    parser.add_argument('--shapes', nargs='+', default=['dict', 'string'], choices=['dict', 'string'],
+                        help='getItem content shapes to test')
+    parser.add_argument('--allocations', type=int, default=2, help='allocations per server')
+    parser.add_argument('--nodes', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated latency per request (s)')
+    parser.add_argument('--reconfigure-latency', type=float, default=0.0, help='simulated reconfigure time (s)')
+    parser.add_argument('--shards', type=int, default=0, help='split the alias into N shard aliases')
+    parser.add_argument('--group-by', default='', choices=['', 'node', 'ip'], help='one alias per node or IP')
+    parser.add_argument('--fetch-mode', default='servers', choices=PterodactylAPI.FETCH_MODES)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+    
+    print(f"fetch mode {args.fetch_mode}, {args.allocations} allocations per server, "
+          f"{args.latency * 1000:.0f} ms latency, {args.workers} workers")
+    print(f"{'allocations':>11}  {'shape':<7}{'cycle':<9}{'outcome':<11}{'wall':>9}"
+          f"{'ptero req':>11}{'ptero bytes':>14}{'opn req':>9}{'opn bytes':>12}{'peak RSS':>11}")
+    
+    for size in args.sizes:
+        servers = max(1, size // args.allocations)
+        panel = FakePterodactyl(servers, args.allocations, args.nodes, latency=args.latency).start()
+        try:
+            for shape in args.shapes:
+                firewall = FakeOPNsense(content_shape=shape, latency=args.latency,
+                                        reconfigure_latency=args.reconfigure_latency).start()
+                try:
+                    for cycle, outcome, elapsed, (p_req, p_bytes), (o_req, o_bytes), rss in \
+                            run_scenario(panel, firewall, args):
+                        print(f"{servers * args.allocations:>11}  {shape:<7}{cycle:<9}{outcome:<11}"
+                              f"{elapsed:>8.3f}s{p_req:>11}{p_bytes:>14,}{o_req:>9}{o_bytes:>12,}"
+                              f"{rss:>8.1f} MB")
+                finally:
+                    firewall.stop()
+        finally:
+            panel.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,402 @@
+"""
+In-process stand-ins for the Pterodactyl application API and the OPNsense alias
+API, used by the benchmarks.
+Each fake runs a ThreadingHTTPServer on 127.0.0.1 in a daemon thread and counts
+requests and response bytes per endpoint.
+"""
+
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class FakeServer:
+    """Base class: serves handle(method, path, query, body) -> (status, payload[, headers])"""
+    
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = {}
+        self.bytes_sent = {}
+        self._lock = threading.Lock()
+        self._server = None
+    
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    @property
+    def total_requests(self) -> int:
+        return sum(self.requests.values())
+    
+    @property
+    def total_bytes(self) -> int:
+        return sum(self.bytes_sent.values())
+    
+    def reset_counters(self):
+        with self._lock:
+            self.requests.clear()
+            self.bytes_sent.clear()
+    
+    def endpoint_name(self, path: str) -> str:
+        return path
+    
+    def handle(self, method: str, path: str, query: dict, body: bytes):
+        raise NotImplementedError
+    
+    def _record(self, path: str, size: int):
+        name = self.endpoint_name(path)
+        with self._lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+            self.bytes_sent[name] = self.bytes_sent.get(name, 0) + size
+    
+    def start(self):
+        fake = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            
+            def _serve(self, method):
+                parts = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                if fake.latency:
+                    time.sleep(fake.latency)
+                status, payload, *extra = fake.handle(method, parts.path, parse_qs(parts.query), body)
+                if not isinstance(payload, bytes):
+                    payload = json.dumps(payload).encode()
+                fake._record(parts.path, len(payload))
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in (extra[0] if extra else {}).items():
+                    self.send_header(name, str(value))
+                self.end_headers()
+                self.wfile.write(payload)
+            
+            def do_GET(self):
+                self._serve('GET')
+            
+            def do_POST(self):
+                self._serve('POST')
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+    
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class FakePterodactyl(FakeServer):
+    """Paginated /api/application servers, nodes and node allocations endpoints
+    
+    With rate_limit set, requests are counted in fixed windows of rate_window
+    seconds like Laravel's throttle middleware: X-RateLimit-* headers on every
+    response and 429 with Retry-After once the window's budget is used up.
+    """
+    
+    def __init__(self, servers: int = 100, allocations_per_server: int = 1, nodes: int = 4,
+                 per_page: int = 50, latency: float = 0.0, first_port: int = 25565,
+                 rate_limit: int = 0, rate_window: float = 60.0):
+        super().__init__(latency)
+        self.per_page = per_page
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.throttled = 0
+        self._window_start = time.monotonic()
+        self._window_used = 0
+        self.nodes = list(range(1, nodes + 1))
+        self.servers = []
+        self.allocations = {node: [] for node in self.nodes}
+        self._pages = {}
+        
+        port = first_port
+        allocation_id = 1
+        for index in range(servers):
+            node = self.nodes[index % len(self.nodes)]
+            server = self._make_server(index + 1, node)
+            for number in range(allocations_per_server):
+                allocation = {
+                    'object': 'allocation',
+                    'attributes': {
+                        'id': allocation_id,
+                        'ip': f"10.0.{node}.1",
+                        'alias': None,
+                        'port': port,
+                        'notes': None,
+                        'assigned': True,
+                        'is_default': number == 0
+                    }
+                }
+                server['attributes']['relationships']['allocations']['data'].append(allocation)
+                self.allocations[node].append((allocation, server))
+                allocation_id += 1
+                port += 1
+                if port > 65535:
+                    port = 1024
+            self.servers.append(server)
+        
+        # Unassigned allocations exist on real nodes as well
+        for node in self.nodes:
+            for _ in range(max(1, servers // (10 * len(self.nodes)))):
+                self.allocations[node].append(({
+                    'object': 'allocation',
+                    'attributes': {'id': allocation_id, 'ip': f"10.0.{node}.1", 'alias': None,
+                                   'port': 1000 + allocation_id % 1000, 'notes': None, 'assigned': False}
+                }, None))
+                allocation_id += 1
+    
+    @staticmethod
+    def _make_server(server_id: int, node: int) -> dict:
+        """A server object shaped like the real application API response"""
+        return {
+            'object': 'server',
+            'attributes': {
+                'id': server_id,
+                'external_id': None,
+                'uuid': f"{server_id:08x}-0000-4000-8000-000000000000",
+                'identifier': f"{server_id:08x}",
+                'name': f"Game Server {server_id}",
+                'description': 'Benchmark server with a reasonably long description text',
+                'status': None,
+                'suspended': False,
+                'limits': {'memory': 4096, 'swap': 0, 'disk': 20480, 'io': 500, 'cpu': 200,
+                           'threads': None, 'oom_disabled': True},
+                'feature_limits': {'databases': 2, 'allocations': 5, 'backups': 3},
+                'user': 1,
+                'node': node,
+                'allocation': server_id,
+                'nest': 1,
+                'egg': 3,
+                'container': {
+                    'startup_command': 'java -Xms128M -Xmx{{SERVER_MEMORY}}M -jar {{SERVER_JARFILE}}',
+                    'image': 'ghcr.io/pterodactyl/yolks:java_17',
+                    'installed': 1,
+                    'environment': {
+                        'SERVER_JARFILE': 'server.jar', 'VANILLA_VERSION': 'latest',
+                        'BUILD_NUMBER': 'latest', 'STARTUP': 'java -jar server.jar',
+                        'P_SERVER_LOCATION': 'de-fra', 'P_SERVER_UUID': f"{server_id:08x}",
+                        'P_SERVER_ALLOCATION_LIMIT': 5
+                    }
+                },
+                'updated_at': '2024-01-01T00:00:00+00:00',
+                'created_at': '2024-01-01T00:00:00+00:00',
+                'relationships': {'allocations': {'object': 'list', 'data': []}}
+            }
+        }
+    
+    def endpoint_name(self, path: str) -> str:
+        if path.startswith('/api/application/nodes/') and path.endswith('/allocations'):
+            return '/api/application/nodes/{id}/allocations'
+        return path
+    
+    def _paginate(self, key, items, query) -> bytes:
+        page = int(query.get('page', ['1'])[0])
+        per_page = int(query.get('per_page', [self.per_page])[0])
+        cache_key = (key, page, per_page)
+        payload = self._pages.get(cache_key)
+        if payload is None:
+            total_pages = max(1, (len(items) + per_page - 1) // per_page)
+            data = items[(page - 1) * per_page:page * per_page]
+            payload = json.dumps({
+                'object': 'list',
+                'data': data,
+                'meta': {'pagination': {
+                    'total': len(items), 'count': len(data), 'per_page': per_page,
+                    'current_page': page, 'total_pages': total_pages, 'links': {}
+                }}
+            }).encode()
+            self._pages[cache_key] = payload
+        return payload
+    
+    def _rate_limit_headers(self):
+        """Count a request against the current window; returns (allowed, headers)"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= self.rate_window:
+                self._window_start = now
+                self._window_used = 0
+            self._window_used += 1
+            allowed = self._window_used <= self.rate_limit
+            headers = {'X-RateLimit-Limit': self.rate_limit,
+                       'X-RateLimit-Remaining': max(0, self.rate_limit - self._window_used)}
+            if not allowed:
+                self.throttled += 1
+                retry_after = self.rate_window - (now - self._window_start)
+                headers['Retry-After'] = max(1, int(retry_after + 0.999))
+            return allowed, headers
+    
+    def handle(self, method, path, query, body):
+        if not self.rate_limit:
+            return self._route(path, query)
+        allowed, headers = self._rate_limit_headers()
+        if not allowed:
+            return 429, {'errors': [{'code': 'TooManyRequestsHttpException'}]}, headers
+        return (*self._route(path, query), headers)
+    
+    def _route(self, path, query):
+        if path == '/api/application/servers':
+            return 200, self._paginate('servers', self.servers, query)
+        
+        if path == '/api/application/nodes':
+            nodes = [{'object': 'node', 'attributes': {'id': node, 'name': f"node-{node}"}} for node in self.nodes]
+            return 200, self._paginate('nodes', nodes, query)
+        
+        parts = path.strip('/').split('/')
+        if len(parts) == 5 and parts[:3] == ['api', 'application', 'nodes'] and parts[4] == 'allocations':
+            node = int(parts[3])
+            if node not in self.allocations:
+                return 404, {'errors': []}
+            include_server = 'server' in query.get('include', [''])[0]
+            key = ('allocations', node, include_server)
+            items = self._pages.get(key)
+            if items is None:
+                items = []
+                for allocation, server in self.allocations[node]:
+                    if include_server and server:
+                        allocation = json.loads(json.dumps(allocation))
+                        attributes = {k: v for k, v in server['attributes'].items() if k != 'relationships'}
+                        allocation['attributes']['relationships'] = {
+                            'server': {'object': 'server', 'attributes': attributes}
+                        }
+                    items.append(allocation)
+                self._pages[key] = items
+            return 200, self._paginate(key, items, query)
+        
+        return 404, {'errors': []}
+
+
+class FakeOPNsense(FakeServer):
+    """Alias endpoints getAliasUUID/getItem/addItem/setItem/reconfigure
+    
+    Starts with one port alias (alias_name); more can be added with add_alias()
+    or through addItem. content_shape selects how getItem returns the alias
+    content: 'dict' (one key per entry, like OPNsense for filled aliases) or
+    'string' (newline-separated).
+    """
+    
+    ALIAS_UUID = '3f1a2b4c-5d6e-4f70-8a9b-0c1d2e3f4a5b'
+    
+    def __init__(self, alias_name: str = 'pterodactyl_ports', entries=(), content_shape: str = 'dict',
+                 latency: float = 0.0, reconfigure_latency: float = 0.0):
+        super().__init__(latency)
+        if content_shape not in ('dict', 'string'):
+            raise ValueError(f"Unknown content shape: {content_shape}")
+        self.alias_name = alias_name
+        self.content_shape = content_shape
+        self.reconfigure_latency = reconfigure_latency
+        self.writes = 0
+        self.reconfigures = 0
+        self.aliases = {}
+        self._uuids = {}
+        self.add_alias(alias_name, entries, self.ALIAS_UUID)
+    
+    def add_alias(self, name: str, entries=(), alias_uuid: str = None) -> str:
+        alias_uuid = alias_uuid or str(uuid.uuid4())
+        with self._lock:
+            self.aliases[alias_uuid] = {'name': name, 'entries': [str(entry) for entry in entries],
+                                        'description': 'Pterodactyl Port Mapper', 'payload': None}
+            self._uuids[name] = alias_uuid
+        return alias_uuid
+    
+    def entries_of(self, name: str = None) -> list:
+        return list(self.aliases[self._uuids[name or self.alias_name]]['entries'])
+    
+    @property
+    def entries(self) -> list:
+        return self.entries_of()
+    
+    def set_entries(self, entries, name: str = None):
+        """Replace an alias' content (e.g. to simulate a manual edit on the firewall)"""
+        with self._lock:
+            alias = self.aliases[self._uuids[name or self.alias_name]]
+            alias['entries'] = [str(entry) for entry in entries]
+            alias['payload'] = None
+    
+    def endpoint_name(self, path: str) -> str:
+        prefix, _, last = path.rpartition('/')
+        if prefix.endswith(('/getAliasUUID', '/getItem', '/setItem')):
+            return prefix + '/{id}'
+        return path
+    
+    def _item_payload(self, alias_uuid: str) -> bytes:
+        with self._lock:
+            alias = self.aliases[alias_uuid]
+            if alias['payload'] is None:
+                if self.content_shape == 'dict':
+                    content = {entry: {'value': entry, 'selected': 1} for entry in alias['entries']}
+                else:
+                    content = '\n'.join(alias['entries'])
+                alias['payload'] = json.dumps({'alias': {
+                    'enabled': '1',
+                    'name': alias['name'],
+                    'type': {'host': {'value': 'Host(s)', 'selected': 0},
+                             'port': {'value': 'Port(s)', 'selected': 1}},
+                    'proto': {'IPv4': {'value': 'IPv4', 'selected': 0}},
+                    'content': content,
+                    'description': alias['description'],
+                }}).encode()
+            return alias['payload']
+    
+    def _validate(self, alias: dict, name: str = None) -> dict:
+        """Validation errors for an addItem/setItem payload, like OPNsense returns them"""
+        errors = {}
+        if not alias.get('name') or (name and alias['name'] != name):
+            errors['alias.name'] = 'Invalid name'
+        for entry in alias.get('content', '').split('\n'):
+            if entry and not entry.replace(':', '').isdigit() and entry not in self._uuids:
+                errors['alias.content'] = f"Entry '{entry}' is not a port, range or alias"
+        return errors
+    
+    def handle(self, method, path, query, body):
+        prefix, _, last = path.rpartition('/')
+        
+        if prefix == '/api/firewall/alias/getAliasUUID':
+            return 200, {'uuid': self._uuids[last]} if last in self._uuids else []
+        
+        if prefix == '/api/firewall/alias/getItem':
+            if last not in self.aliases:
+                return 404, {'errorMessage': 'Not found'}
+            return 200, self._item_payload(last)
+        
+        if path == '/api/firewall/alias/addItem' and method == 'POST':
+            alias = json.loads(body or b'{}').get('alias', {})
+            errors = self._validate(alias)
+            if alias.get('name') in self._uuids:
+                errors['alias.name'] = 'An alias with this name already exists'
+            if errors:
+                return 200, {'result': 'failed', 'validations': errors}
+            alias_uuid = self.add_alias(alias['name'], (line for line in alias.get('content', '').split('\n') if line))
+            self.writes += 1
+            return 200, {'result': 'saved', 'uuid': alias_uuid}
+        
+        if prefix == '/api/firewall/alias/setItem' and method == 'POST':
+            if last not in self.aliases:
+                return 404, {'errorMessage': 'Not found'}
+            alias = json.loads(body or b'{}').get('alias', {})
+            errors = self._validate(alias, self.aliases[last]['name'])
+            if errors:
+                return 200, {'result': 'failed', 'validations': errors}
+            self.set_entries((line for line in alias.get('content', '').split('\n') if line),
+                             self.aliases[last]['name'])
+            self.writes += 1
+            return 200, {'result': 'saved'}
+        
+        if path == '/api/firewall/alias/reconfigure' and method == 'POST':
+            if self.reconfigure_latency:
+                time.sleep(self.reconfigure_latency)
+            self.reconfigures += 1
+            return 200, {'status': 'ok'}
+        
+        return 404, {'errorMessage': 'Endpoint not found'}
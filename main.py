@@ -5,532 +5,2883 @@ Automatically synchronizes port forwarding rules between Pterodactyl and OPNsens
 """
 
 import requests
+import cProfile
+import hashlib
 import json
+import logging
 import os
+import pstats
+import random
+import re
+import sys
+import tempfile
+import threading
 import time
-from typing import List, Dict, Set
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable, Iterator, List, Dict, Set, Tuple
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 from datetime import datetime
+from email.utils import parsedate_to_datetime
+from itertools import compress
 
 # Load .env file
 load_dotenv()
 
 
+logger = logging.getLogger('portmapper')
+
+
+class LogFormatter(logging.Formatter):
+    """Text or JSON log lines; `extra` fields are appended as key=value or JSON keys"""
+    
+    RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+    
+    def __init__(self, json_lines: bool = False):
+        super().__init__(datefmt='%Y-%m-%d %H:%M:%S')
+        self.json_lines = json_lines
+    
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {key: value for key, value in vars(record).items() if key not in self.RESERVED}
+        if self.json_lines:
+            line = {
+                'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                'level': record.levelname.lower(),
+                'message': record.getMessage(),
+            }
+            line.update(fields)
+            if record.exc_info:
+                line['exception'] = self.formatException(record.exc_info)
+            return json.dumps(line, default=str, ensure_ascii=False)
+        
+        message = record.getMessage()
+        target = fields.pop('target', None)
+        if target:
+            message = f"[{target}] {message}"
+        text = f"{self.formatTime(record, self.datefmt)} {record.levelname:<7} {message}"
+        if fields:
+            text += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            text += '\n' + self.formatException(record.exc_info)
+        return text
+
+
+def configure_logging(level: str = 'INFO', json_lines: bool = False):
+    """Send portmapper logs to stdout at the given level"""
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(LogFormatter(json_lines))
+    logger.handlers[:] = [handler]
+    logger.setLevel(level.upper())
+    logger.propagate = False
+
+
+class PortList:
+    """Port set rendered as compact ranges only when a log record is actually formatted
+    
+    Up to `limit` entries are shown (0 = all), the rest is summarised.
+    """
+    
+    __slots__ = ('ports', 'limit')
+    
+    def __init__(self, ports, limit: int = 50):
+        self.ports = ports
+        self.limit = limit
+    
+    def __str__(self) -> str:
+        entries = compact_port_ranges(self.ports)
+        if self.limit and len(entries) > self.limit:
+            return f"{', '.join(entries[:self.limit])} … (+{len(entries) - self.limit} more)"
+        return ', '.join(entries) or '-'
+
+
+class Metrics:
+    """Thread-safe counters, gauges and histograms, rendered in the Prometheus text format
+    
+    Metrics must be declared with describe() before use; label sets are free-form
+    per sample.
+    """
+    
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str]] = {}
+        self._samples: Dict[str, Dict[Tuple, object]] = {}
+    
+    def describe(self, name: str, kind: str, help_text: str):
+        """Declare a metric of kind counter, gauge or histogram"""
+        with self._lock:
+            self._meta[name] = (kind, help_text)
+            self._samples.setdefault(name, {})
+    
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._samples[name]
+            series[key] = series.get(key, 0) + value
+    
+    def set(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._samples[name][key] = value
+    
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._samples[name]
+            histogram = series.get(key)
+            if histogram is None:
+                # Per-bucket counts (made cumulative on render), sum, count
+                histogram = series[key] = [[0] * len(self.BUCKETS), 0.0, 0]
+            index = bisect_left(self.BUCKETS, value)
+            if index < len(self.BUCKETS):
+                histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+    
+    @staticmethod
+    def _format_labels(key: Tuple, **extra) -> str:
+        pairs = list(key) + list(extra.items())
+        if not pairs:
+            return ''
+        escaped = (
+            (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for name, value in pairs
+        )
+        return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+    
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in self._meta.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in self._samples[name].items():
+                    if kind != 'histogram':
+                        lines.append(f"{name}{self._format_labels(key)} {value}")
+                        continue
+                    bucket_counts, total, count = value
+                    cumulative = 0
+                    for bound, bucket_count in zip(self.BUCKETS, bucket_counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{self._format_labels(key, le=bound)} {cumulative}")
+                    lines.append(f"{name}_bucket{self._format_labels(key, le='+Inf')} {count}")
+                    lines.append(f"{name}_sum{self._format_labels(key)} {total}")
+                    lines.append(f"{name}_count{self._format_labels(key)} {count}")
+        return '\n'.join(lines) + '\n'
+    
+    def handle_request(self) -> Tuple[int, str, str]:
+        """ControlServer route handler for GET /metrics"""
+        return 200, self.CONTENT_TYPE, self.render()
+
+
+metrics = Metrics()
+for _name, _kind, _help in (
+    ('portmapper_sync_duration_seconds', 'histogram', 'Duration of complete sync cycles'),
+    ('portmapper_phase_duration_seconds', 'histogram',
+     'Duration of sync phases (pterodactyl_fetch, opnsense_read, diff, set_item, reconfigure)'),
+    ('portmapper_syncs_total', 'counter', 'Sync cycles by outcome'),
+    ('portmapper_target_syncs_total', 'counter', 'Per-firewall syncs by outcome'),
+    ('portmapper_skipped_total', 'counter', 'Per-firewall syncs that skipped work, by reason'),
+    ('portmapper_errors_total', 'counter', 'Errors by component'),
+    ('portmapper_http_requests_total', 'counter', 'Upstream HTTP requests, including retries'),
+    ('portmapper_http_request_duration_seconds', 'histogram', 'Upstream HTTP request latency'),
+    ('portmapper_http_response_bytes_total', 'counter', 'Upstream HTTP response body bytes'),
+    ('portmapper_pterodactyl_pages_total', 'counter', 'Pterodactyl listing pages fetched, by result'),
+    ('portmapper_allocations', 'gauge', 'Allocations in the last complete Pterodactyl snapshot'),
+    ('portmapper_ports', 'gauge', 'Ports tracked from Pterodactyl after exclusions'),
+    ('portmapper_alias_ports', 'gauge', 'Ports found in the alias at the last read'),
+    ('portmapper_ports_added_total', 'counter', 'Ports added to the alias'),
+    ('portmapper_ports_removed_total', 'counter', 'Ports removed from the alias'),
+    ('portmapper_reconfigures_total', 'counter', 'Firewall reconfigures by result (ok, failed, coalesced)'),
+    ('portmapper_sync_interval_seconds', 'gauge', 'Current wait time between syncs'),
+    ('portmapper_sync_interval_reason', 'gauge', 'Why the current sync interval was chosen (1 for the active reason)'),
+    ('portmapper_rate_limit_wait_seconds_total', 'counter', 'Time spent waiting for the upstream rate limit'),
+    ('portmapper_circuit_open', 'gauge', 'Whether the circuit breaker of an upstream is open'),
+):
+    metrics.describe(_name, _kind, _help)
+
+# OPNsense model UUIDs and numeric ids are folded into one endpoint label
+_UUID_SEGMENT = re.compile(r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$')
+
+
+def endpoint_label(url: str) -> Tuple[str, str]:
+    """(host, path template) of an URL for per-endpoint metrics"""
+    parts = urlsplit(url)
+    segments = [
+        '{id}' if segment.isdigit() else '{uuid}' if _UUID_SEGMENT.match(segment) else segment
+        for segment in parts.path.split('/')
+    ]
+    return parts.netloc, '/'.join(segments)
+
+
+class Tracer:
+    """Per-cycle timing spans, written as one JSON line per sync cycle
+    
+    Phases are recorded as spans with their start offset in the cycle; frequent
+    operations (HTTP requests, JSON decoding, ...) are summed up per name.
+    Disabled and close to free until open() is called.
+    """
+    
+    MAX_SPANS = 500
+    
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._output = None
+        self._cycle = 0
+        self._started = time.perf_counter()
+        self._started_at = time.time()
+        self._spans: List[Dict] = []
+        self._dropped = 0
+        self._totals: Dict[str, Dict[str, float]] = {}
+    
+    def open(self, path: str):
+        """Append cycle lines to a file, or to stdout for '-'"""
+        self._output = sys.stdout if path == '-' else open(path, 'a', buffering=1, encoding='utf-8')
+        self.enabled = True
+    
+    def begin_cycle(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._cycle += 1
+            self._started = time.perf_counter()
+            self._started_at = time.time()
+            self._spans = []
+            self._dropped = 0
+            self._totals = {}
+    
+    def record(self, name: str, started: float, seconds: float, **fields):
+        """Add a span that started at perf_counter() value started"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if len(self._spans) >= self.MAX_SPANS:
+                self._dropped += 1
+                return
+            span = {'name': name, 'start': round(started - self._started, 6), 'duration': round(seconds, 6)}
+            span.update(fields)
+            self._spans.append(span)
+    
+    @contextmanager
+    def span(self, name: str, **fields):
+        """Record the duration of a with-block as a span"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started, time.perf_counter() - started, **fields)
+    
+    def add(self, name: str, seconds: float, count: int = 1, size: int = 0):
+        """Sum up a frequent operation into the cycle totals"""
+        if not self.enabled:
+            return
+        with self._lock:
+            total = self._totals.get(name)
+            if total is None:
+                total = self._totals[name] = {'count': 0, 'seconds': 0.0, 'max': 0.0}
+            total['count'] += count
+            total['seconds'] += seconds
+            total['max'] = max(total['max'], seconds)
+            if size:
+                total['bytes'] = total.get('bytes', 0) + size
+    
+    def end_cycle(self, **summary):
+        """Write the cycle line with the given summary fields"""
+        if not self.enabled:
+            return
+        with self._lock:
+            line = {
+                'cycle': self._cycle,
+                'time': datetime.fromtimestamp(self._started_at).isoformat(timespec='seconds'),
+                'duration': round(time.perf_counter() - self._started, 6),
+            }
+            line.update(summary)
+            line['spans'] = self._spans
+            if self._dropped:
+                line['dropped_spans'] = self._dropped
+            line['totals'] = {
+                name: {key: round(value, 6) if isinstance(value, float) else value for key, value in total.items()}
+                for name, total in sorted(self._totals.items())
+            }
+        self._output.write(json.dumps(line, default=str) + '\n')
+        self._output.flush()
+
+
+tracer = Tracer()
+
+
+@contextmanager
+def phase_timer(phase: str, **labels):
+    """Time a sync phase into the phase histogram and the cycle trace"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe('portmapper_phase_duration_seconds', elapsed, phase=phase, **labels)
+        tracer.record(phase, started, elapsed, **labels)
+
+
+class CycleProfiler:
+    """Profiles every Nth sync cycle and writes the stats to a directory
+    
+    'sample' mode samples the stacks of all threads and writes them in the
+    collapsed stack format (flamegraph.pl, speedscope). 'cprofile' mode writes
+    pstats files covering the sync thread and the workers wrapped with wrap().
+    Only the newest `keep` files are kept.
+    """
+    
+    MODES = ('sample', 'cprofile')
+    SAMPLE_INTERVAL = 0.005
+    
+    def __init__(self):
+        self.every = 0
+        self.directory = ''
+        self.mode = 'sample'
+        self.keep = 20
+        self.active = False
+        self._cycle = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profile = None
+        self._profiles: List[cProfile.Profile] = []
+        self._samples: Dict[str, int] = {}
+        self._sampler = None
+        self._stop = threading.Event()
+    
+    def configure(self, every: int, directory: str, mode: str = 'sample', keep: int = 20):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown profile mode '{mode}' (expected one of {', '.join(self.MODES)})")
+        os.makedirs(directory, exist_ok=True)
+        self.every = max(0, every)
+        self.directory = directory
+        self.mode = mode
+        self.keep = max(1, keep)
+    
+    def begin_cycle(self) -> bool:
+        """Start profiling if this cycle is due, returns whether it is"""
+        if not self.every:
+            return False
+        self._cycle += 1
+        if self._cycle % self.every:
+            return False
+        self.active = True
+        if self.mode == 'cprofile':
+            self._profiles = []
+            self._profile = cProfile.Profile()
+            self._local.profiling = True
+            self._profile.enable()
+        else:
+            self._samples = {}
+            self._stop.clear()
+            self._sampler = threading.Thread(target=self._sample, name='profiler', daemon=True)
+            self._sampler.start()
+        return True
+    
+    def wrap(self, fn: Callable) -> Callable:
+        """fn profiled in the thread it runs on, while a cProfile cycle is active"""
+        if not self.active or self.mode != 'cprofile':
+            return fn
+        
+        def profiled(*args, **kwargs):
+            if getattr(self._local, 'profiling', False):
+                return fn(*args, **kwargs)
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler is active (on Python 3.12+ one per process):
+                # never let profiling fail the work itself
+                return fn(*args, **kwargs)
+            self._local.profiling = True
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profile.disable()
+                self._local.profiling = False
+                with self._lock:
+                    self._profiles.append(profile)
+        return profiled
+    
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.SAMPLE_INTERVAL):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, 'thread'))
+                key = ';'.join(reversed(stack))
+                self._samples[key] = self._samples.get(key, 0) + 1
+    
+    def end_cycle(self) -> str:
+        """Stop profiling and write the stats, returns the file path ('' if not profiled)"""
+        if not self.active:
+            return ''
+        self.active = False
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-cycle{self._cycle}"
+        if self.mode == 'cprofile':
+            self._profile.disable()
+            self._local.profiling = False
+            stats = pstats.Stats(self._profile)
+            with self._lock:
+                for profile in self._profiles:
+                    stats.add(profile)
+            path = os.path.join(self.directory, name + '.prof')
+            stats.dump_stats(path)
+        else:
+            self._stop.set()
+            self._sampler.join()
+            path = os.path.join(self.directory, name + '.folded')
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in sorted(self._samples.items()):
+                    f.write(f"{stack} {count}\n")
+        self._prune()
+        return path
+    
+    def _prune(self):
+        files = sorted(
+            entry for entry in os.listdir(self.directory)
+            if '-cycle' in entry and entry.endswith(('.prof', '.folded'))
+        )
+        for entry in files[:-self.keep]:
+            try:
+                os.remove(os.path.join(self.directory, entry))
+            except OSError:
+                pass
+
+
+profiler = CycleProfiler()
+
+
+class RateLimiter:
+    """Token bucket that paces requests to stay within an API's per-minute rate limit
+    
+    The bucket holds up to per_minute tokens and refills continuously. If no
+    limit is configured it is learned from X-RateLimit-Limit; until then requests
+    are not paced. X-RateLimit-Remaining caps the tokens (other clients may share
+    the key) and a 429 blocks all requests until its Retry-After has passed.
+    """
+    
+    def __init__(self, per_minute: float = 0, max_wait: float = 120):
+        self.per_minute = per_minute
+        self.learn_limit = not per_minute
+        self.max_wait = max_wait
+        self._tokens = float(per_minute)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def parse_retry_after(value: str) -> float:
+        """Retry-After in seconds (delta-seconds or HTTP date), 0 if missing or invalid"""
+        if not value:
+            return 0.0
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return 0.0
+    
+    def _refill(self, now: float):
+        if self.per_minute:
+            self._tokens = min(self.per_minute, self._tokens + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+    
+    def acquire(self) -> float:
+        """Take one token, sleeping until one is available; returns the time waited"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._blocked_until:
+                    delay = self._blocked_until - now
+                elif not self.per_minute:
+                    return waited
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                else:
+                    delay = (1 - self._tokens) * 60 / self.per_minute
+            time.sleep(delay)
+            waited += delay
+    
+    def update(self, response: requests.Response) -> float:
+        """Adjust the bucket from a response's rate limit headers
+        
+        Returns the Retry-After delay of a throttled response (0 otherwise).
+        """
+        headers = response.headers
+        try:
+            limit = int(headers.get('X-RateLimit-Limit', 0))
+            remaining = int(headers['X-RateLimit-Remaining']) if 'X-RateLimit-Remaining' in headers else None
+        except ValueError:
+            limit, remaining = 0, None
+        
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if limit > 0 and self.learn_limit and limit != self.per_minute:
+                self.per_minute = limit
+                self._tokens = float(limit)
+            if remaining is not None:
+                self._tokens = min(self._tokens, remaining)
+            if response.status_code != 429:
+                return 0.0
+            
+            retry_after = self.parse_retry_after(headers.get('Retry-After'))
+            if not retry_after:
+                retry_after = 60 / self.per_minute if self.per_minute else 1.0
+            retry_after = min(retry_after, self.max_wait)
+            self._tokens = 0.0
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+            return retry_after
+
+
+class HttpTransport:
+    """Shared HTTP transport with pooled keep-alive connections per host"""
+    
+    IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+    RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+    
+    def __init__(self, connect_timeout: float = 5.0, read_timeout: float = 30.0,
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 10.0,
+                 max_per_host: int = 4):
+        """Initialize session, connection pools and per-host limits"""
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_per_host = max(1, max_per_host)
+        
+        # One keep-alive pool per host, sized to the per-host concurrency cap
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=self.max_per_host, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._rate_limiters: Dict[str, RateLimiter] = {}
+        self._lock = threading.Lock()
+    
+    def set_rate_limiter(self, url: str, limiter: RateLimiter):
+        """Pace all requests to the host of an URL with a rate limiter"""
+        self._rate_limiters[urlsplit(url).netloc] = limiter
+    
+    def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+        """Get the concurrency semaphore for the host of an URL"""
+        host = urlsplit(url).netloc
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.max_per_host)
+                self._host_slots[host] = slot
+            return slot
+    
+    def _backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff delay for a retry attempt"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+    
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a request; idempotent calls are retried with jittered backoff
+        
+        Hosts with a rate limiter are paced by it, and a throttled (429) retry
+        waits for the Retry-After the server asked for instead of the backoff.
+        """
+        method = method.upper()
+        kwargs.setdefault('timeout', self.timeout)
+        retries = self.max_retries if method in self.IDEMPOTENT_METHODS else 0
+        slot = self._host_slot(url)
+        upstream, endpoint = endpoint_label(url)
+        limiter = self._rate_limiters.get(upstream)
+        
+        attempt = 0
+        while True:
+            if limiter:
+                waited = limiter.acquire()
+                if waited:
+                    metrics.inc('portmapper_rate_limit_wait_seconds_total', waited, upstream=upstream)
+            started = time.perf_counter()
+            try:
+                with slot:
+                    response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                metrics.inc('portmapper_http_requests_total', upstream=upstream, endpoint=endpoint,
+                            method=method, status='error')
+                tracer.add(f"http {method} {upstream}{endpoint} error", time.perf_counter() - started)
+                if attempt >= retries:
+                    raise
+            else:
+                elapsed = time.perf_counter() - started
+                metrics.observe('portmapper_http_request_duration_seconds', elapsed,
+                                upstream=upstream, endpoint=endpoint)
+                tracer.add(f"http {method} {upstream}{endpoint}", elapsed, size=len(response.content))
+                metrics.inc('portmapper_http_requests_total', upstream=upstream, endpoint=endpoint,
+                            method=method, status=response.status_code)
+                metrics.inc('portmapper_http_response_bytes_total', len(response.content),
+                            upstream=upstream, endpoint=endpoint)
+                retry_after = limiter.update(response) if limiter else 0.0
+                if response.status_code not in self.RETRY_STATUS_CODES or attempt >= retries:
+                    return response
+                response.close()
+                if retry_after:
+                    # The limiter holds the next attempt back until Retry-After has passed
+                    attempt += 1
+                    continue
+            
+            time.sleep(self._backoff(attempt))
+            attempt += 1
+    
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+    
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+    
+    def pool_stats(self) -> Dict[str, Dict[str, int]]:
+        """Connection pool hits (reused) and misses (new connections) per host"""
+        stats = {}
+        seen = set()
+        for adapter in self.session.adapters.values():
+            if id(adapter) in seen:
+                continue
+            seen.add(id(adapter))
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host = f"{pool.host}:{pool.port}"
+                entry = stats.setdefault(host, {'hits': 0, 'misses': 0})
+                entry['misses'] += pool.num_connections
+                entry['hits'] += max(0, pool.num_requests - pool.num_connections)
+        return stats
+    
+    def pool_summary(self) -> str:
+        """One-line summary of connection reuse across all hosts"""
+        stats = self.pool_stats()
+        hits = sum(entry['hits'] for entry in stats.values())
+        misses = sum(entry['misses'] for entry in stats.values())
+        return f"{hits} reused, {misses} new across {len(stats)} host(s)"
+
+
+class IncompleteSnapshotError(Exception):
+    """Raised when not all server pages could be fetched from Pterodactyl"""
+    
+    def __init__(self, message: str, failed_pages: List[int] = None, total_pages: int = 0,
+                 throttled: bool = False):
+        super().__init__(message)
+        self.failed_pages = failed_pages or []
+        self.total_pages = total_pages
+        self.throttled = throttled
+
+
+class AliasReadError(Exception):
+    """Raised when the OPNsense alias could not be read"""
+
+
+# Each byte value expanded to eight 0/1 flags (lowest bit first), for fast bitmap iteration
+_BYTE_FLAGS = tuple(bytes(value >> bit & 1 for bit in range(8)) for value in range(256))
+
+
+class PortSet:
+    """Fixed-size bitmap of TCP/UDP ports (0-65535)
+    
+    Backed by an 8 KiB bytearray (bit n = port n). Union, difference and
+    intersection run on the whole bitmap at C speed via int conversion,
+    iteration expands the bitmap through a byte lookup table, and contiguous
+    ranges can be set or read back directly.
+    """
+    
+    SIZE = 65536
+    __slots__ = ('_bits',)
+    
+    def __init__(self, ports: Iterable[int] = ()):
+        if isinstance(ports, PortSet):
+            self._bits = bytearray(ports._bits)
+            return
+        self._bits = bytearray(self.SIZE // 8)
+        self.update(ports)
+    
+    @classmethod
+    def _from_int(cls, value: int) -> 'PortSet':
+        result = cls.__new__(cls)
+        result._bits = bytearray(value.to_bytes(cls.SIZE // 8, 'little'))
+        return result
+    
+    @classmethod
+    def from_ranges(cls, ranges: Iterable[Tuple[int, int]]) -> 'PortSet':
+        result = cls()
+        for start, end in ranges:
+            result.add_range(start, end)
+        return result
+    
+    def _as_int(self) -> int:
+        return int.from_bytes(self._bits, 'little')
+    
+    @staticmethod
+    def _check(port: int) -> int:
+        if not 0 <= port < PortSet.SIZE:
+            raise ValueError(f"Port {port} out of range 0-{PortSet.SIZE - 1}")
+        return port
+    
+    def add(self, port: int):
+        self._check(port)
+        self._bits[port >> 3] |= 1 << (port & 7)
+    
+    def discard(self, port: int):
+        if 0 <= port < self.SIZE:
+            self._bits[port >> 3] &= ~(1 << (port & 7)) & 0xFF
+    
+    def add_range(self, start: int, end: int):
+        """Set all ports from start to end (inclusive)"""
+        self._check(start)
+        self._check(end)
+        if end < start:
+            return
+        first_full = (start + 7) >> 3
+        last_full = (end + 1) >> 3
+        if first_full < last_full:
+            self._bits[first_full:last_full] = b'\xff' * (last_full - first_full)
+            for port in range(start, first_full << 3):
+                self.add(port)
+            for port in range(last_full << 3, end + 1):
+                self.add(port)
+        else:
+            for port in range(start, end + 1):
+                self.add(port)
+    
+    def update(self, ports: Iterable[int]):
+        if isinstance(ports, PortSet):
+            self._bits = bytearray((self._as_int() | ports._as_int()).to_bytes(self.SIZE // 8, 'little'))
+            return
+        # Inlined add() - this is the hot path when building from allocations
+        bits = self._bits
+        size = self.SIZE
+        for port in ports:
+            if not 0 <= port < size:
+                self._check(port)
+            bits[port >> 3] |= 1 << (port & 7)
+    
+    def __contains__(self, port) -> bool:
+        return isinstance(port, int) and 0 <= port < self.SIZE and bool(self._bits[port >> 3] >> (port & 7) & 1)
+    
+    def __len__(self) -> int:
+        return self._as_int().bit_count()
+    
+    def __bool__(self) -> bool:
+        return any(self._bits)
+    
+    def __iter__(self) -> Iterator[int]:
+        """Iterate set ports in ascending order"""
+        # Expand each byte to eight 0/1 flags, then let itertools pick the set ports
+        flags = b''.join(map(_BYTE_FLAGS.__getitem__, self._bits))
+        return compress(range(self.SIZE), flags)
+    
+    def ranges(self) -> Iterator[Tuple[int, int]]:
+        """Iterate contiguous runs of ports as (start, end) tuples"""
+        start = prev = None
+        for port in self:
+            if prev is not None and port == prev + 1:
+                prev = port
+                continue
+            if start is not None:
+                yield start, prev
+            start = prev = port
+        if start is not None:
+            yield start, prev
+    
+    def to_bytes(self) -> bytes:
+        return bytes(self._bits)
+    
+    @staticmethod
+    def _coerce(other) -> 'PortSet':
+        return other if isinstance(other, PortSet) else PortSet(other)
+    
+    def __or__(self, other) -> 'PortSet':
+        return self._from_int(self._as_int() | self._coerce(other)._as_int())
+    
+    def __and__(self, other) -> 'PortSet':
+        return self._from_int(self._as_int() & self._coerce(other)._as_int())
+    
+    def __sub__(self, other) -> 'PortSet':
+        return self._from_int(self._as_int() & ~self._coerce(other)._as_int())
+    
+    def __xor__(self, other) -> 'PortSet':
+        return self._from_int(self._as_int() ^ self._coerce(other)._as_int())
+    
+    __ror__ = __or__
+    __rand__ = __and__
+    
+    def __rsub__(self, other) -> 'PortSet':
+        return self._coerce(other) - self
+    
+    def __eq__(self, other) -> bool:
+        if isinstance(other, PortSet):
+            return self._bits == other._bits
+        if isinstance(other, (set, frozenset)):
+            return len(self) == len(other) and all(port in self for port in other)
+        return NotImplemented
+    
+    __hash__ = None
+    
+    def __repr__(self) -> str:
+        return f"PortSet({len(self)} ports)"
+
+
+class Allocation:
+    """One Pterodactyl allocation with the server it is assigned to
+    
+    Slotted to keep per-allocation memory small on large panels. Item access
+    (allocation['port']) is supported for compatibility with the former dicts.
+    """
+    
+    __slots__ = ('id', 'port', 'ip', 'node_id', 'server_name', 'server_id', 'server_uuid', 'is_default')
+    
+    def __init__(self, id: int, port: int, ip: str, node_id: int = None, server_name: str = None,
+                 server_id: str = None, server_uuid: str = None, is_default: bool = None):
+        self.id = id
+        self.port = port
+        self.ip = ip
+        self.node_id = node_id
+        self.server_name = server_name
+        self.server_id = server_id
+        self.server_uuid = server_uuid
+        self.is_default = is_default
+    
+    @property
+    def allocation_id(self) -> str:
+        return f"allocation_{self.id}"
+    
+    def __getitem__(self, key: str):
+        return getattr(self, key)
+    
+    def __repr__(self) -> str:
+        return f"Allocation({self.ip}:{self.port}, server={self.server_name!r})"
+
+
 class PterodactylAPI:
-    def __init__(self, panel_url: str, api_key: str):
-        """Initialize Pterodactyl API connection"""
+    FETCH_MODES = ('servers', 'nodes')
+    
+    def __init__(self, panel_url: str, api_key: str, transport: HttpTransport = None, page_workers: int = 4,
+                 fetch_mode: str = 'servers', rate_limiter: RateLimiter = None):
+        """Initialize Pterodactyl API connection
+        
+        All panel requests are paced by rate_limiter; by default one that learns
+        the limit from the panel's X-RateLimit headers.
+        """
+        if fetch_mode not in self.FETCH_MODES:
+            raise ValueError(f"Unknown fetch mode '{fetch_mode}' (expected one of {', '.join(self.FETCH_MODES)})")
         self.panel_url = panel_url.rstrip('/')
         self.api_key = api_key
+        self.transport = transport or HttpTransport()
+        self.page_workers = max(1, page_workers)
+        self.fetch_mode = fetch_mode
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.transport.set_rate_limiter(self.panel_url, self.rate_limiter)
         self.headers = {
             'Authorization': f'Bearer {api_key}',
             'Accept': 'application/json',
             'Content-Type': 'application/json'
         }
+        
+        # Short description of the last fetch for log output, e.g. "12 servers"
+        self.last_fetch_summary = ''
+        
+        # Server names by allocation id, resolved on demand in node mode
+        self._server_names: Dict[int, str] = {}
+        self._server_names_lock = threading.Lock()
+    
+    def _fetch_page(self, path: str, page: int, params: str = '') -> Dict:
+        """Fetch a single page of a paginated application API listing"""
+        url = f"{self.panel_url}{path}?page={page}{params}"
+        try:
+            response = self.transport.get(url, headers=self.headers)
+        except requests.RequestException:
+            metrics.inc('portmapper_pterodactyl_pages_total', result='failed')
+            raise
+        
+        if response.status_code != 200:
+            metrics.inc('portmapper_pterodactyl_pages_total', result='failed')
+            raise IncompleteSnapshotError(
+                f"Error fetching {path} page {page}: {response.status_code} - {response.text}",
+                failed_pages=[page],
+                throttled=response.status_code == 429
+            )
+        
+        metrics.inc('portmapper_pterodactyl_pages_total', result='ok')
+        started = time.perf_counter()
+        data = response.json()
+        tracer.add('json_decode', time.perf_counter() - started, size=len(response.content))
+        return data
+    
+    def _iter_ordered(self, keys: List, fetch: Callable) -> Iterator[Tuple[object, object]]:
+        """Run fetch(key) concurrently and yield (key, result or exception) in key order
+        
+        At most page_workers results are in flight or buffered at any time, so
+        memory stays bounded no matter how many keys there are.
+        """
+        if not keys:
+            return
+        fetch = profiler.wrap(fetch)
+        with ThreadPoolExecutor(max_workers=min(self.page_workers, len(keys))) as executor:
+            pending = deque()
+            remaining = iter(keys)
+            for key in remaining:
+                pending.append((key, executor.submit(fetch, key)))
+                if len(pending) >= self.page_workers:
+                    break
+            
+            while pending:
+                key, future = pending.popleft()
+                for next_key in remaining:
+                    pending.append((next_key, executor.submit(fetch, next_key)))
+                    break
+                started = time.perf_counter()
+                try:
+                    result = future.result()
+                except (IncompleteSnapshotError, requests.RequestException, ValueError, KeyError) as e:
+                    result = e
+                tracer.add('page_wait', time.perf_counter() - started)
+                yield key, result
+    
+    def _iter_paginated(self, path: str, params: str = '') -> Iterator[Dict]:
+        """Stream all items of a listing, page by page
+        
+        Page 1 is fetched first to learn the page count, the remaining pages
+        are fetched concurrently and yielded in page order. Pages that were
+        still throttled after the transport's retries get one more, paced
+        attempt at the end. Raises IncompleteSnapshotError after the last page
+        if any page failed.
+        """
+        try:
+            first = self._fetch_page(path, 1, params)
+        except requests.RequestException as e:
+            raise IncompleteSnapshotError(f"Error fetching {path} page 1: {e}", failed_pages=[1]) from e
+        
+        total_pages = first.get('meta', {}).get('pagination', {}).get('total_pages', 1)
+        yield from first['data']
+        del first
+        
+        failed_pages = []
+        errors = []
+        throttled_pages = []
+        pages = list(range(2, total_pages + 1))
+        for page, result in self._iter_ordered(pages, lambda page: self._fetch_page(path, page, params)):
+            if isinstance(result, IncompleteSnapshotError) and result.throttled:
+                throttled_pages.append(page)
+                continue
+            if isinstance(result, Exception) or 'data' not in result:
+                failed_pages.append(page)
+                errors.append(str(result) if isinstance(result, Exception) else f"page {page} has no data")
+                continue
+            yield from result['data']
+        
+        # Sequential second pass: the rate limiter spaces these out
+        for page in throttled_pages:
+            try:
+                result = self._fetch_page(path, page, params)
+            except (IncompleteSnapshotError, requests.RequestException, ValueError) as e:
+                failed_pages.append(page)
+                errors.append(str(e))
+                continue
+            if 'data' not in result:
+                failed_pages.append(page)
+                errors.append(f"page {page} has no data")
+                continue
+            yield from result['data']
+        
+        if failed_pages:
+            raise IncompleteSnapshotError(
+                f"{len(failed_pages)} of {total_pages} pages of {path} failed: {errors[0]}",
+                failed_pages=failed_pages,
+                total_pages=total_pages
+            )
+    
+    def iter_servers(self) -> Iterator[Dict]:
+        """Stream all servers with allocations from Pterodactyl Panel"""
+        count = 0
+        for server in self._iter_paginated('/api/application/servers', '&include=allocations'):
+            count += 1
+            yield server
+        self.last_fetch_summary = f"{count} servers"
     
     def get_all_servers(self) -> List[Dict]:
         """Fetch all servers with allocations from Pterodactyl Panel"""
-        servers = []
-        page = 1
+        return list(self.iter_servers())
+    
+    def iter_allocations(self) -> Iterator[Allocation]:
+        """Stream all allocations in the configured fetch mode"""
+        if self.fetch_mode == 'nodes':
+            return self.iter_node_allocations()
+        return self.iter_server_allocations(self.iter_servers())
+    
+    def get_allocations(self) -> List[Allocation]:
+        """Fetch all allocations in the configured fetch mode"""
+        return list(self.iter_allocations())
+    
+    def iter_server_allocations(self, servers: Iterable[Dict]) -> Iterator[Allocation]:
+        """Stream allocations with server information from server objects"""
+        count = 0
+        elapsed = 0.0
+        try:
+            for server in servers:
+                started = time.perf_counter()
+                allocations = self._server_allocations(server)
+                elapsed += time.perf_counter() - started
+                count += len(allocations)
+                yield from allocations
+        finally:
+            tracer.add('extract_allocations', elapsed, count=count)
+    
+    @staticmethod
+    def _server_allocations(server: Dict) -> List[Allocation]:
+        """Allocations of one server object"""
+        attributes = server.get('attributes', {})
+        server_name = attributes.get('name', 'Unknown')
+        server_id = attributes.get('identifier', 'Unknown')
+        server_uuid = attributes.get('uuid', 'Unknown')
+        node_id = attributes.get('node')
         
-        while True:
-            url = f"{self.panel_url}/api/application/servers?include=allocations&page={page}"
-            response = requests.get(url, headers=self.headers)
-            
-            if response.status_code != 200:
-                print(f"❌ Error fetching servers: {response.status_code}")
-                print(f"Response: {response.text}")
-                break
-            
-            data = response.json()
-            servers.extend(data['data'])
-            
-            meta = data.get('meta', {}).get('pagination', {})
-            if meta.get('current_page', 1) >= meta.get('total_pages', 1):
-                break
-            
-            page += 1
+        relationships = attributes.get('relationships', {})
+        allocations_data = relationships.get('allocations', {}).get('data', [])
         
-        return servers
+        allocations = []
+        for allocation in allocations_data:
+            alloc_attrs = allocation.get('attributes', {})
+            allocations.append(Allocation(
+                alloc_attrs.get('id', 0),
+                alloc_attrs.get('port', 0),
+                sys.intern(alloc_attrs.get('ip') or 'Unknown'),
+                node_id,
+                server_name,
+                server_id,
+                server_uuid,
+                alloc_attrs.get('is_default', False)
+            ))
+        return allocations
     
-    def extract_allocations(self, servers: List[Dict]) -> List[Dict]:
+    def extract_allocations(self, servers: List[Dict]) -> List[Allocation]:
         """Extract all allocations with server information"""
-        allocations = []
+        return list(self.iter_server_allocations(servers))
+    
+    def get_nodes(self) -> List[Dict]:
+        """Fetch all nodes"""
+        return list(self._iter_paginated('/api/application/nodes'))
+    
+    def fetch_node_allocations(self, node_id: int, include_server: bool = False) -> List[Dict]:
+        """Fetch all allocations of one node"""
+        params = '&per_page=500' + ('&include=server' if include_server else '')
+        return list(self._iter_paginated(f"/api/application/nodes/{node_id}/allocations", params))
+    
+    def iter_node_allocations(self) -> Iterator[Allocation]:
+        """Stream assigned allocations per node, fetched concurrently across nodes
         
-        for server in servers:
-            attributes = server.get('attributes', {})
-            server_name = attributes.get('name', 'Unknown')
-            server_id = attributes.get('identifier', 'Unknown')
-            server_uuid = attributes.get('uuid', 'Unknown')
-            
-            relationships = attributes.get('relationships', {})
-            allocations_data = relationships.get('allocations', {}).get('data', [])
+        Much lighter than servers?include=allocations since only the allocation
+        objects are transferred. Server names are not included and are resolved
+        lazily via resolve_server_names().
+        """
+        node_ids = [node.get('attributes', {}).get('id') for node in self.get_nodes()]
+        failed = []
+        
+        for node_id, node_allocations in self._iter_ordered(node_ids, self.fetch_node_allocations):
+            if isinstance(node_allocations, Exception):
+                failed.append(f"node {node_id}: {node_allocations}")
+                continue
             
-            for allocation in allocations_data:
+            started = time.perf_counter()
+            allocations = []
+            for allocation in node_allocations:
                 alloc_attrs = allocation.get('attributes', {})
-                allocations.append({
-                    'server_name': server_name,
-                    'server_id': server_id,
-                    'server_uuid': server_uuid,
-                    'ip': alloc_attrs.get('ip', 'Unknown'),
-                    'port': alloc_attrs.get('port', 0),
-                    'is_default': alloc_attrs.get('is_default', False),
-                    'allocation_id': allocation.get('object') + '_' + str(alloc_attrs.get('id', 0))
-                })
+                if not alloc_attrs.get('assigned'):
+                    continue
+                allocation_id = alloc_attrs.get('id', 0)
+                allocations.append(Allocation(
+                    allocation_id,
+                    alloc_attrs.get('port', 0),
+                    sys.intern(alloc_attrs.get('ip') or 'Unknown'),
+                    node_id,
+                    self._server_names.get(allocation_id)
+                ))
+            del node_allocations
+            tracer.add('extract_allocations', time.perf_counter() - started, count=len(allocations))
+            yield from allocations
         
-        return allocations
+        if failed:
+            raise IncompleteSnapshotError(f"{len(failed)} of {len(node_ids)} nodes failed: {failed[0]}")
+        
+        self.last_fetch_summary = f"{len(node_ids)} nodes"
+    
+    def resolve_server_names(self, allocations: List[Allocation]):
+        """Fill in missing server names (node mode) for the given allocations
+        
+        Only the nodes of the given allocations are fetched again, with the
+        server relationship included. Names are cached by allocation id.
+        """
+        with self._server_names_lock:
+            missing = [a for a in allocations if not a.server_name]
+            for node_id in sorted({a.node_id for a in missing if a.node_id is not None}):
+                try:
+                    for allocation in self.fetch_node_allocations(node_id, include_server=True):
+                        alloc_attrs = allocation.get('attributes', {})
+                        server = alloc_attrs.get('relationships', {}).get('server', {})
+                        name = server.get('attributes', {}).get('name') if isinstance(server, dict) else None
+                        if name:
+                            self._server_names[alloc_attrs.get('id', 0)] = name
+                except (IncompleteSnapshotError, requests.RequestException) as e:
+                    logger.warning("⚠️  Could not resolve server names for node %s: %s", node_id, e)
+            
+            for allocation in missing:
+                allocation.server_name = self._server_names.get(allocation.id, 'Unknown')
+
+
+class PortSnapshot:
+    """Ports of one Pterodactyl fetch, built in a single streaming pass
+    
+    Keeps the port set and a port -> allocations index, so reporting on a
+    set of changed ports costs O(changes) instead of a scan over all
+    allocations. Raw server objects are never retained.
+    """
+    
+    def __init__(self, allocations: Iterable[Allocation] = ()):
+        self.ports = PortSet()
+        self.by_port: Dict[int, List[Allocation]] = {}
+        self.allocation_count = 0
+        for allocation in allocations:
+            self.add(allocation)
+    
+    def add(self, allocation: Allocation):
+        self.allocation_count += 1
+        entries = self.by_port.get(allocation.port)
+        if entries is None:
+            self.ports.add(allocation.port)
+            self.by_port[allocation.port] = [allocation]
+        else:
+            entries.append(allocation)
+    
+    def allocations_for(self, ports: Iterable[int]) -> List[Allocation]:
+        """All allocations using the given ports, in port order"""
+        return [allocation for port in sorted(ports) for allocation in self.by_port.get(port, ())]
+
+
+def compact_port_ranges(ports) -> List[str]:
+    """Collapse ports into sorted alias entries, contiguous runs as 'start:end'"""
+    return [
+        str(start) if start == end else f"{start}:{end}"
+        for start, end in PortSet(ports).ranges()
+    ]
+
+
+def split_port_entries(entries: List[str]) -> Tuple[PortSet, List[str]]:
+    """Expand port and 'start:end' range entries; returns (ports, other entries)"""
+    ports = PortSet()
+    others = []
+    for entry in entries:
+        if entry.isdigit() and int(entry) < PortSet.SIZE:
+            ports.add(int(entry))
+            continue
+        start, sep, end = entry.replace('-', ':').partition(':')
+        if sep and start.isdigit() and end.isdigit() and int(start) <= int(end) < PortSet.SIZE:
+            ports.add_range(int(start), int(end))
+        else:
+            # Nested aliases or anything else we don't manage
+            others.append(entry)
+    return ports, others
 
 
 class OPNsenseAPI:
-    def __init__(self, url: str, api_key: str, api_secret: str, alias_name: str, verify_ssl: bool = True):
+    ALIAS_META_FIELDS = ('enabled', 'name', 'type', 'description')
+    
+    # Set by ShardedOPNsenseAPI when the parent alias must be rewritten even
+    # though no port changed
+    layout_outdated = False
+    
+    def __init__(self, url: str, api_key: str, api_secret: str, alias_name: str, verify_ssl: bool = True,
+                 transport: HttpTransport = None, cache_ttl: float = 300, use_ranges: bool = True,
+                 timeout: Tuple[float, float] = None, name: str = ''):
         """Initialize OPNsense API connection"""
         self.url = url.rstrip('/')
         self.auth = (api_key, api_secret)
         self.alias_name = alias_name
         self.verify_ssl = verify_ssl
+        self.transport = transport or HttpTransport()
+        self.use_ranges = use_ranges
+        self.timeout = timeout
+        self.name = name or urlsplit(self.url).netloc
+        
+        # Cached alias UUID and non-content fields (enabled/name/type/description)
+        self.cache_ttl = cache_ttl
+        self._alias_uuid = ''
+        self._alias_uuid_time = 0.0
+        self._alias_meta: Dict[str, str] = {}
+        self._alias_meta_time = 0.0
+        
+        # Last known alias content (newline-joined) and whether the last write changed it
+        self._known_content = None
+        self.content_changed = False
         
         if not verify_ssl:
             import urllib3
             urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
     
-    def get_alias_uuid(self) -> str:
-        """Get the UUID of the alias"""
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send an authenticated request, applying this firewall's timeout if set"""
+        if self.timeout:
+            kwargs.setdefault('timeout', self.timeout)
+        return self.transport.request(method, url, auth=self.auth, verify=self.verify_ssl, **kwargs)
+    
+    def _cache_fresh(self, cached_at: float) -> bool:
+        return self.cache_ttl > 0 and time.monotonic() - cached_at < self.cache_ttl
+    
+    def invalidate_alias_cache(self):
+        """Forget the cached alias UUID and metadata"""
+        self._alias_uuid = ''
+        self._alias_meta = {}
+        self._alias_uuid_time = 0.0
+        self._alias_meta_time = 0.0
+        self._known_content = None
+    
+    def export_alias_cache(self) -> Dict:
+        """Cached alias UUID and metadata, for the state file"""
+        return {'alias_uuid': self._alias_uuid, 'alias_meta': dict(self._alias_meta)}
+    
+    def restore_alias_cache(self, alias_uuid: str, alias_meta: Dict[str, str]):
+        """Seed the alias cache from a state file (fresh for one cache TTL)"""
+        now = time.monotonic()
+        if alias_uuid:
+            self._alias_uuid = str(alias_uuid)
+            self._alias_uuid_time = now
+        if alias_meta:
+            self._alias_meta = {field: str(alias_meta.get(field, '')) for field in self.ALIAS_META_FIELDS}
+            self._alias_meta_time = now
+    
+    @staticmethod
+    def _alias_field(alias_item: Dict, field: str, default: str = '') -> str:
+        """Extract a field value - can be dict.selected or a plain string"""
+        val = alias_item.get(field, default)
+        if isinstance(val, dict):
+            return val.get('selected', default)
+        return val if val else default
+    
+    def _remember_alias_meta(self, alias_item: Dict):
+        """Cache the non-content fields and the current content of an alias item"""
+        self._alias_meta = {
+            field: self._alias_field(alias_item, field)
+            for field in self.ALIAS_META_FIELDS
+        }
+        self._alias_meta_time = time.monotonic()
+        self._known_content = '\n'.join(self._content_entries(alias_item.get('content', {})))
+    
+    def lookup_alias_uuid(self) -> str:
+        """Get the UUID of the alias (cached), '' only if OPNsense reports no such alias
+        
+        Raises AliasReadError if the lookup itself fails, so a transient error is
+        never mistaken for a missing alias.
+        """
+        if self._alias_uuid and self._cache_fresh(self._alias_uuid_time):
+            return self._alias_uuid
+        
         url = f"{self.url}/api/firewall/alias/getAliasUUID/{self.alias_name}"
         try:
-            response = requests.get(url, auth=self.auth, verify=self.verify_ssl)
-            if response.status_code == 200:
-                data = response.json()
-                return data.get('uuid', '')
-            return ''
-        except Exception as e:
-            print(f"❌ Error fetching alias UUID: {e}")
+            response = self._request('GET', url)
+            data = response.json() if response.status_code == 200 else None
+        except (requests.RequestException, ValueError) as e:
+            raise AliasReadError(f"Error fetching alias UUID of '{self.alias_name}': {e}") from e
+        if response.status_code != 200:
+            raise AliasReadError(f"HTTP {response.status_code} fetching alias UUID of '{self.alias_name}'")
+        
+        alias_uuid = data.get('uuid', '') if isinstance(data, dict) else ''
+        if alias_uuid:
+            self._alias_uuid = alias_uuid
+            self._alias_uuid_time = time.monotonic()
+        return alias_uuid
+    
+    def get_alias_uuid(self) -> str:
+        """Get the UUID of the alias (cached), '' if it is missing or can't be looked up"""
+        try:
+            return self.lookup_alias_uuid()
+        except AliasReadError as e:
+            logger.error("❌ %s", e)
             return ''
     
-    def get_alias_content(self) -> Dict:
-        """Fetch complete alias with all entries"""
+    def _get_alias_item(self) -> Dict:
+        """Fetch the raw getItem response; re-resolves the UUID once on 404"""
+        for attempt in range(2):
+            alias_uuid = self.get_alias_uuid()
+            if not alias_uuid:
+                return {}
+            
+            url = f"{self.url}/api/firewall/alias/getItem/{alias_uuid}"
+            response = self._request('GET', url)
+            if response.status_code == 404:
+                # Alias was deleted or recreated with a new UUID
+                self.invalidate_alias_cache()
+                continue
+            if response.status_code != 200:
+                logger.error("❌ Error fetching alias '%s': %s", self.alias_name, response.text)
+                return {}
+            
+            started = time.perf_counter()
+            data = response.json()
+            tracer.add('json_decode', time.perf_counter() - started, size=len(response.content))
+            alias_item = data.get('alias', {})
+            if alias_item:
+                self._remember_alias_meta(alias_item)
+            return data
+        return {}
+    
+    def _set_alias_content(self, content: str, default_description: str = '') -> bool:
+        """Write alias content via setItem, using cached metadata when fresh
+        
+        Sets content_changed to False if the write left the content byte-identical.
+        """
+        self.content_changed = False
         alias_uuid = self.get_alias_uuid()
         if not alias_uuid:
-            print(f"❌ Alias '{self.alias_name}' not found!")
-            return {}
+            logger.error("❌ Alias '%s' not found!", self.alias_name)
+            return False
+        
+        if not (self._alias_meta and self._cache_fresh(self._alias_meta_time)):
+            if not self._get_alias_item().get('alias'):
+                return False
+            alias_uuid = self._alias_uuid
         
-        url = f"{self.url}/api/firewall/alias/getItem/{alias_uuid}"
+        meta = self._alias_meta
+        update_data = {
+            'alias': {
+                'enabled': meta.get('enabled') or '1',
+                'name': meta.get('name') or self.alias_name,
+                'type': meta.get('type') or 'port',
+                'content': content,  # As newline-separated string
+                'description': meta.get('description') or default_description
+            }
+        }
+        
+        url = f"{self.url}/api/firewall/alias/setItem/{alias_uuid}"
+        response = self._request(
+            'POST',
+            url,
+            json=update_data,
+            headers={'Content-Type': 'application/json'}
+        )
+        
+        if response.status_code == 200:
+            result = response.json()
+            if result.get('result') == 'saved':
+                self.content_changed = self._known_content != content
+                self._known_content = content
+                return True
+            # Validation errors usually mean our cached metadata is stale
+            if 'validations' in result:
+                self.invalidate_alias_cache()
+            logger.error("❌ Error updating alias '%s': %s", self.alias_name, result)
+            return False
+        
+        if response.status_code == 404:
+            self.invalidate_alias_cache()
+        logger.error("❌ HTTP %s updating alias '%s': %s", response.status_code, self.alias_name, response.text)
+        return False
+    
+    @staticmethod
+    def _content_entries(content) -> List[str]:
+        """Extract the entries from alias content (dict with rows or newline string)"""
+        entries = []
+        if isinstance(content, dict):
+            for key, value_dict in content.items():
+                if key.startswith('row_'):
+                    selected = value_dict.get('selected', '')
+                    if selected:
+                        entries.append(str(selected))
+                else:
+                    entries.append(key)
+        elif isinstance(content, str) and content:
+            entries = [line.strip() for line in content.split('\n') if line.strip()]
+        return entries
+    
+    def get_alias_content(self) -> Dict:
+        """Fetch complete alias with all entries"""
         try:
-            response = requests.get(url, auth=self.auth, verify=self.verify_ssl)
-            if response.status_code == 200:
-                return response.json()
-            return {}
+            data = self._get_alias_item()
+            if not data:
+                logger.error("❌ Alias '%s' not found!", self.alias_name)
+            return data
         except Exception as e:
-            print(f"❌ Error fetching alias: {e}")
+            logger.error("❌ Error fetching alias '%s': %s", self.alias_name, e)
             return {}
     
-    def get_alias_ports(self) -> Set[int]:
-        """Fetch all ports from alias via getItem"""
-        alias_uuid = self.get_alias_uuid()
-        if not alias_uuid:
-            return set()
+    def read_alias_ports(self) -> PortSet:
+        """Fetch all ports from alias via getItem; raises AliasReadError if it can't be read"""
+        try:
+            alias_data = self._get_alias_item().get('alias')
+        except (requests.RequestException, ValueError) as e:
+            raise AliasReadError(f"Error fetching alias '{self.alias_name}': {e}") from e
+        if not alias_data:
+            raise AliasReadError(f"Alias '{self.alias_name}' not found or not readable")
         
-        url = f"{self.url}/api/firewall/alias/getItem/{alias_uuid}"
+        # Content can be either a Dict (with entries) or a string (empty)
+        ports, _ = split_port_entries(self._content_entries(alias_data.get('content', {})))
+        return ports
+    
+    def read_existing_alias_ports(self) -> PortSet:
+        """Like read_alias_ports(), but None if the alias does not exist (yet)"""
+        if not self.lookup_alias_uuid():
+            return None
+        return self.read_alias_ports()
+    
+    def write_alias_ports(self, ports: Set[int]) -> bool:
+        """Write the ports to the alias, creating it if it does not exist (yet)"""
+        self.content_changed = False
         try:
-            response = requests.get(url, auth=self.auth, verify=self.verify_ssl)
-            if response.status_code == 200:
-                data = response.json()
-                alias_data = data.get('alias', {})
-                
-                # Content can be either a Dict (with entries) or a string (empty) is
-                content = alias_data.get('content', {})
-                
-                ports = set()
-                
-                # If content is a Dict (has entries)
-                if isinstance(content, dict):
-                    for key, value_dict in content.items():
-                        # Keys können row_X oder direkt die Ports is
-                        # If the key is a number, use it directly
-                        if key.isdigit():
-                            ports.add(int(key))
-                        # Otherwise check row_X format
-                        elif key.startswith('row_'):
-                            selected_value = value_dict.get('selected', '')
-                            if selected_value and str(selected_value).isdigit():
-                                ports.add(int(selected_value))
-                # If content is a string (kann auch newline-separated is)
-                elif isinstance(content, str) and content:
-                    for line in content.split('\n'):
-                        line = line.strip()
-                        if line and line.isdigit():
-                            ports.add(int(line))
-                
-                return ports
-            return set()
+            exists = bool(self.lookup_alias_uuid())
+        except AliasReadError as e:
+            logger.error("❌ %s", e)
+            return False
+        if exists:
+            return self.update_alias_ports(ports)
+        if not self.create_alias(self.format_content(ports)):
+            return False
+        self.content_changed = True
+        return True
+    
+    def get_alias_ports(self) -> PortSet:
+        """Fetch all ports from alias via getItem (empty on errors)"""
+        try:
+            return self.read_alias_ports()
         except Exception as e:
-            print(f"❌ Error fetching ports: {e}")
-            return set()
+            logger.error("❌ Error fetching ports: %s", e)
+            return PortSet()
     
-    def add_port_to_alias(self, port: int, description: str) -> bool:
-        """Add a port to alias via setItem"""
-        alias_uuid = self.get_alias_uuid()
-        if not alias_uuid:
-            print(f"  ❌ Alias '{self.alias_name}' not found!")
-            return False
-        
-        # Get current alias content
-        url = f"{self.url}/api/firewall/alias/getItem/{alias_uuid}"
+    def format_content(self, ports: Set[int], other_entries: List[str] = ()) -> str:
+        """Build newline-separated alias content, contiguous ports as ranges if enabled"""
+        if self.use_ranges:
+            entries = compact_port_ranges(ports)
+        else:
+            entries = [str(p) for p in sorted(ports)]
+        return '\n'.join(entries + sorted(other_entries))
+    
+    def apply_delta(self, add: Set[int] = frozenset(), remove: Set[int] = frozenset()) -> bool:
+        """Add and remove a batch of ports with one getItem and one setItem"""
         try:
-            response = requests.get(url, auth=self.auth, verify=self.verify_ssl)
-            if response.status_code != 200:
-                print(f"  ❌ Error fetching alias: {response.text}")
+            alias_item = self._get_alias_item().get('alias')
+            if not alias_item:
+                logger.error("❌ Alias '%s' not found!", self.alias_name)
                 return False
             
-            alias_item = response.json().get('alias', {})
-            
-            # Extract only the 'selected' values from content
-            # Content kann Dict (with entries) oder String (empty/"") is
-            content = alias_item.get('content', {})
-            current_ports = []
-            
-            if isinstance(content, dict):
-                for key, value_dict in content.items():
-                    if key.startswith('row_'):
-                        selected = value_dict.get('selected', '')
-                        if selected:
-                            current_ports.append(selected)
-            elif isinstance(content, str) and content:
-                current_ports = [line.strip() for line in content.split('\n') if line.strip()]
+            ports, others = split_port_entries(self._content_entries(alias_item.get('content', {})))
+            added = PortSet(add) - ports
+            removed = PortSet(remove) & ports
             
-            # Check if port already exists
-            port_str = str(port)
-            if port_str in current_ports:
-                print(f"  ℹ️  Port {port} already in alias")
+            if not added and not removed:
+                logger.info("ℹ️  Alias '%s' already up to date", self.alias_name)
                 return True
             
-            # Add new port
-            current_ports.append(port_str)
-            
-            # Extract values - können dict.selected oder direkt string is
-            def get_value(field, default=''):
-                val = alias_item.get(field, default)
-                if isinstance(val, dict):
-                    return val.get('selected', default)
-                return val if val else default
-            
-            # Create update payload
-            update_data = {
-                'alias': {
-                    'enabled': get_value('enabled', '1'),
-                    'name': get_value('name', self.alias_name),
-                    'type': get_value('type', 'port'),
-                    'content': '\n'.join(current_ports),  # As newline-separated string
-                    'description': get_value('description', '')
-                }
-            }
-            
-            # Update via setItem
-            url = f"{self.url}/api/firewall/alias/setItem/{alias_uuid}"
-            response = requests.post(
-                url,
-                auth=self.auth,
-                json=update_data,
-                verify=self.verify_ssl,
-                headers={'Content-Type': 'application/json'}
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('result') == 'saved':
-                    print(f"  ✅ Port {port} added to alias")
-                    return True
-                else:
-                    print(f"  ❌ Error: {result}")
-                    return False
+            if not self._set_alias_content(self.format_content((ports | added) - removed, others)):
+                return False
             
-            print(f"  ❌ HTTP {response.status_code}: {response.text}")
-            return False
+            logger.info("✅ Alias '%s' updated: %d added, %d removed", self.alias_name, len(added), len(removed))
+            return True
             
         except Exception as e:
-            print(f"  ❌ Error: {e}")
+            logger.error("❌ Error updating alias '%s': %s", self.alias_name, e)
             return False
     
+    def add_port_to_alias(self, port: int, description: str = '') -> bool:
+        """Add a port to alias via setItem"""
+        return self.apply_delta(add={port})
+    
     def remove_port_from_alias(self, port: int) -> bool:
         """Remove a port from alias via setItem"""
-        alias_uuid = self.get_alias_uuid()
-        if not alias_uuid:
-            print(f"  ❌ Alias '{self.alias_name}' not found!")
-            return False
+        return self.apply_delta(remove={port})
+    
+    def update_alias_ports(self, ports: Set[int], allocations: List[Allocation] = None) -> bool:
+        """Update alias with all ports at once (Bulk Update)
         
-        # Get current alias content
-        url = f"{self.url}/api/firewall/alias/getItem/{alias_uuid}"
+        With a fresh metadata cache this is a single setItem request.
+        """
         try:
-            response = requests.get(url, auth=self.auth, verify=self.verify_ssl)
-            if response.status_code != 200:
-                print(f"  ❌ Error fetching alias: {response.text}")
-                return False
-            
-            alias_item = response.json().get('alias', {})
-            
-            # Extract only the 'selected' values from content
-            # Content kann Dict (with entries) oder String (empty/"") is
-            content = alias_item.get('content', {})
-            current_ports = []
-            
-            if isinstance(content, dict):
-                for key, value_dict in content.items():
-                    if key.startswith('row_'):
-                        selected = value_dict.get('selected', '')
-                        if selected:
-                            current_ports.append(selected)
-            elif isinstance(content, str) and content:
-                current_ports = [line.strip() for line in content.split('\n') if line.strip()]
-            
-            # Check if port exists
-            port_str = str(port)
-            if port_str not in current_ports:
-                print(f"  ℹ️  Port {port} not found in alias")
-                return True
-            
-            # Remove port
-            current_ports.remove(port_str)
-            
-            # Extract values - können dict.selected oder direkt string is
-            def get_value(field, default=''):
-                val = alias_item.get(field, default)
-                if isinstance(val, dict):
-                    return val.get('selected', default)
-                return val if val else default
-            
-            # Create update payload
-            update_data = {
-                'alias': {
-                    'enabled': get_value('enabled', '1'),
-                    'name': get_value('name', self.alias_name),
-                    'type': get_value('type', 'port'),
-                    'content': '\n'.join(current_ports),  # As newline-separated string
-                    'description': get_value('description', '')
-                }
+            return self._set_alias_content(self.format_content(ports), 'Pterodactyl Port Mapper')
+        except Exception as e:
+            logger.error("❌ Error updating alias '%s': %s", self.alias_name, e)
+            return False
+    
+    def create_alias(self, content: str = '', description: str = 'Pterodactyl Port Mapper') -> bool:
+        """Create this alias as a port alias via addItem"""
+        url = f"{self.url}/api/firewall/alias/addItem"
+        payload = {
+            'alias': {
+                'enabled': '1',
+                'name': self.alias_name,
+                'type': 'port',
+                'content': content,
+                'description': description
             }
-            
-            # Update via setItem
-            url = f"{self.url}/api/firewall/alias/setItem/{alias_uuid}"
-            response = requests.post(
-                url,
-                auth=self.auth,
-                json=update_data,
-                verify=self.verify_ssl,
-                headers={'Content-Type': 'application/json'}
-            )
-            
+        }
+        try:
+            response = self._request('POST', url, json=payload, headers={'Content-Type': 'application/json'})
+            result = response.json() if response.status_code == 200 else None
+        except (requests.RequestException, ValueError) as e:
+            logger.error("❌ Error creating alias '%s': %s", self.alias_name, e)
+            return False
+        if response.status_code == 200:
+            if isinstance(result, dict) and result.get('result') == 'saved':
+                self.invalidate_alias_cache()
+                if result.get('uuid'):
+                    self._alias_uuid = result['uuid']
+                    self._alias_uuid_time = time.monotonic()
+                self._known_content = content
+                return True
+            logger.error("❌ Error creating alias '%s': %s", self.alias_name, result)
+            return False
+        logger.error("❌ HTTP %s creating alias '%s': %s", response.status_code, self.alias_name, response.text)
+        return False
+    
+    def reconfigure_firewall(self) -> bool:
+        """Apply firewall changes (reconfigure)"""
+        url = f"{self.url}/api/firewall/alias/reconfigure"
+        try:
+            response = self._request('POST', url)
             if response.status_code == 200:
-                result = response.json()
-                if result.get('result') == 'saved':
-                    print(f"  🗑️  Port {port} removed from alias")
-                    return True
-                else:
-                    print(f"  ❌ Error: {result}")
-                    return False
-            
-            print(f"  ❌ HTTP {response.status_code}: {response.text}")
+                logger.info("✅ Firewall reconfigured", extra={'target': self.name})
+                return True
+            logger.warning("⚠️  Reconfigure failed: %s - %s", response.status_code, response.text, extra={'target': self.name})
             return False
-            
         except Exception as e:
-            print(f"  ❌ Error: {e}")
+            logger.error("❌ Error during reconfigure: %s", e, extra={'target': self.name})
             return False
+
+
+class ShardedOPNsenseAPI(OPNsenseAPI):
+    """Port alias split by port range into shard aliases, nested in a parent alias
     
-    def update_alias_ports(self, ports: Set[int], allocations: List[Dict]) -> bool:
-        """Update alias with all ports at once (Bulk Update)"""
-        alias_uuid = self.get_alias_uuid()
-        if not alias_uuid:
-            print(f"❌ Alias '{self.alias_name}' not found!")
-            return False
+    The parent alias (alias_name, the one the NAT rule references) only lists
+    the shard aliases <alias_name>_1 ... <alias_name>_N, each holding the ports
+    of one contiguous port range. Shards are read in parallel, only shards
+    whose ports changed are written (in parallel) and missing shards are
+    created. The parent alias itself must exist.
+    """
+    
+    def __init__(self, *args, shards: int = 4, **kwargs):
+        super().__init__(*args, **kwargs)
+        shard_count = max(2, shards)
+        span = -(-PortSet.SIZE // shard_count)
+        self.shards = []
+        for index in range(shard_count):
+            start = index * span
+            end = min(PortSet.SIZE, start + span) - 1
+            api = OPNsenseAPI(
+                self.url, *self.auth, f"{self.alias_name}_{index + 1}", self.verify_ssl, self.transport,
+                self.cache_ttl, self.use_ranges, self.timeout, name=self.name
+            )
+            self.shards.append((api, PortSet.from_ranges([(start, end)])))
+        self.shard_names = [api.alias_name for api, _ in self.shards]
         
-        # Get current alias content
-        url = f"{self.url}/api/firewall/alias/getItem/{alias_uuid}"
+        # Ports per shard as of the last read (None = unknown or missing, always written)
+        self._shard_ports: List[PortSet] = [None] * shard_count
+        self._pool = ThreadPoolExecutor(max_workers=min(shard_count, 8), thread_name_prefix='shard')
+    
+    def read_alias_ports(self) -> PortSet:
+        """Union of all shard ports; flags layout_outdated if the parent or a shard needs fixing"""
+        read_shard = profiler.wrap(OPNsenseAPI.read_existing_alias_ports)
+        futures = [self._pool.submit(read_shard, shard) for shard, _ in self.shards]
         try:
-            response = requests.get(url, auth=self.auth, verify=self.verify_ssl)
-            if response.status_code != 200:
-                print(f"❌ Error fetching alias: {response.text}")
+            parent = self._get_alias_item().get('alias')
+        except (requests.RequestException, ValueError) as e:
+            raise AliasReadError(f"Error fetching alias '{self.alias_name}': {e}") from e
+        if not parent:
+            raise AliasReadError(f"Alias '{self.alias_name}' not found or not readable")
+        
+        ports = PortSet()
+        for index, future in enumerate(futures):
+            shard_ports = future.result()
+            self._shard_ports[index] = shard_ports
+            if shard_ports is not None:
+                ports.update(shard_ports)
+        
+        parent_entries = self._content_entries(parent.get('content', {}))
+        self.layout_outdated = parent_entries != self.shard_names or None in self._shard_ports
+        return ports
+    
+    def apply_delta(self, add: Set[int] = frozenset(), remove: Set[int] = frozenset()) -> bool:
+        """Add and remove a batch of ports, touching only the affected shards"""
+        try:
+            current = self.read_alias_ports()
+        except AliasReadError as e:
+            logger.error("❌ %s", e)
+            return False
+        return self.update_alias_ports((current | PortSet(add)) - PortSet(remove))
+    
+    def _write_shard(self, index: int, ports: PortSet) -> bool:
+        shard, _ = self.shards[index]
+        if not shard.write_alias_ports(ports):
+            return False
+        self._shard_ports[index] = ports
+        return True
+    
+    def update_alias_ports(self, ports: Set[int], allocations: List[Allocation] = None) -> bool:
+        """Write the shards whose ports changed in parallel, then the parent if needed"""
+        ports = PortSet(ports)
+        changed = [
+            (index, ports & port_range)
+            for index, (_, port_range) in enumerate(self.shards)
+            if self._shard_ports[index] is None or self._shard_ports[index] != ports & port_range
+        ]
+        for shard, _ in self.shards:
+            shard.content_changed = False
+        
+        results = list(self._pool.map(profiler.wrap(lambda job: self._write_shard(*job)), changed))
+        shards_changed = any(shard.content_changed for shard, _ in self.shards)
+        if changed:
+            logger.info("📦 %d of %d shard aliases written", sum(results), len(self.shards))
+        if not all(results):
+            self.content_changed = shards_changed
+            return False
+        
+        if self.layout_outdated:
+            try:
+                if not self._set_alias_content('\n'.join(self.shard_names), 'Pterodactyl Port Mapper'):
+                    self.content_changed = shards_changed
+                    return False
+            except (requests.RequestException, ValueError) as e:
+                logger.error("❌ Error updating parent alias '%s': %s", self.alias_name, e)
+                self.content_changed = shards_changed
                 return False
+            logger.info("🧱 Parent alias '%s' now nests %d shards", self.alias_name, len(self.shard_names))
+            self.layout_outdated = False
+            self.content_changed = self.content_changed or shards_changed
+        else:
+            self.content_changed = shards_changed
+        return True
+
+
+class ControlServer:
+    """Small HTTP server for local control endpoints, served from a daemon thread
+    
+    Route handlers take no arguments and return (status, content_type, body).
+    If a token is set, requests must send it as 'Authorization: Bearer <token>'.
+    """
+    
+    def __init__(self, host: str, port: int, token: str = ''):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.routes: Dict[Tuple[str, str], Callable[[], Tuple[int, str, str]]] = {}
+        self._server = None
+    
+    def add_route(self, method: str, path: str, handler: Callable[[], Tuple[int, str, str]]):
+        self.routes[(method.upper(), path)] = handler
+    
+    def _make_handler(self):
+        control = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def _dispatch(self, method: str):
+                path = self.path.split('?', 1)[0]
+                handler = control.routes.get((method, path))
+                if handler is None:
+                    status, content_type, body = 404, 'text/plain', 'Not Found\n'
+                elif control.token and self.headers.get('Authorization', '') != f"Bearer {control.token}":
+                    status, content_type, body = 401, 'text/plain', 'Unauthorized\n'
+                else:
+                    status, content_type, body = handler()
+                
+                payload = body.encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
             
-            alias_item = response.json().get('alias', {})
-            
-            # Extract values - können dict.selected oder direkt string is
-            def get_value(field, default=''):
-                val = alias_item.get(field, default)
-                if isinstance(val, dict):
-                    return val.get('selected', default)
-                return val if val else default
+            def do_GET(self):
+                self._dispatch('GET')
             
-            # Convert all ports to strings and sort them
-            port_strings = sorted([str(p) for p in ports])
+            def do_POST(self):
+                # Drain the request body so keep-alive clients stay in sync
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+                self._dispatch('POST')
             
-            # Create update payload mit ALLEN Ports
-            update_data = {
-                'alias': {
-                    'enabled': get_value('enabled', '1'),
-                    'name': get_value('name', self.alias_name),
-                    'type': get_value('type', 'port'),
-                    'content': '\n'.join(port_strings),  # All ports as newline-separated string
-                    'description': get_value('description', 'Pterodactyl Port Mapper')
-                }
-            }
+            def log_message(self, format, *args):
+                pass
+        
+        return Handler
+    
+    def start(self):
+        """Bind and serve in a background thread"""
+        self._server = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+    
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def parse_listen_address(value: str, default_host: str = '127.0.0.1') -> Tuple[str, int]:
+    """Parse 'host:port' or 'port' into a (host, port) tuple"""
+    host, _, port = value.strip().rpartition(':')
+    return (host or default_host), int(port)
+
+
+class SyncTrigger:
+    """Coalesces external sync requests with a debounce window
+    
+    A burst of triggers results in a single sync once no new trigger arrived
+    for `debounce` seconds, but at most `max_delay` seconds after the first one.
+    """
+    
+    def __init__(self, debounce: float = 2.0, max_delay: float = 10.0):
+        self.debounce = debounce
+        self.max_delay = max(debounce, max_delay)
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._first = 0.0
+        self._last = 0.0
+        self._pending = 0
+    
+    def fire(self):
+        """Request a sync as soon as the debounce window has passed"""
+        now = time.monotonic()
+        with self._lock:
+            if not self._pending:
+                self._first = now
+            self._last = now
+            self._pending += 1
+        self._event.set()
+    
+    def handle_request(self) -> Tuple[int, str, str]:
+        """ControlServer route handler"""
+        self.fire()
+        return 202, 'application/json', json.dumps({'status': 'queued'}) + '\n'
+    
+    def wait(self, timeout: float) -> int:
+        """Wait up to timeout for triggers; returns the number of coalesced triggers (0 on timeout)"""
+        if not self._event.wait(timeout):
+            return 0
+        
+        while True:
+            with self._lock:
+                wake_at = min(self._last + self.debounce, self._first + self.max_delay)
+            remaining = wake_at - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(remaining)
+        
+        with self._lock:
+            count = self._pending
+            self._pending = 0
+            self._event.clear()
+        return count
+
+
+# Outcomes returned by PortMapperSync.sync(); SYNC_SKIPPED only occurs per firewall
+SYNC_CHANGED = 'changed'
+SYNC_UNCHANGED = 'unchanged'
+SYNC_ERROR = 'error'
+SYNC_SKIPPED = 'skipped'
+
+
+class AdaptiveScheduler:
+    """Chooses the wait time before the next sync from recent outcomes
+    
+    After a change the interval drops to min_interval (allocations tend to come
+    in bursts), quiet cycles back off exponentially up to max_interval and
+    failing cycles back off from the base interval. `reason_code` is one of
+    REASONS, `reason` is the same for humans.
+    """
+    
+    REASONS = ('startup', 'change', 'quiet', 'errors', 'recovered')
+    
+    def __init__(self, base_interval: float, min_interval: float = None, max_interval: float = None,
+                 backoff_factor: float = 2.0):
+        self.base_interval = base_interval
+        self.min_interval = min(base_interval, min_interval if min_interval is not None else base_interval)
+        self.max_interval = max(base_interval, max_interval if max_interval is not None else base_interval)
+        self.backoff_factor = backoff_factor
+        self.interval = base_interval
+        self.reason = 'startup'
+        self.reason_code = 'startup'
+        self.quiet_cycles = 0
+        self.error_cycles = 0
+    
+    def next_interval(self, outcome: str) -> float:
+        """Update and return the interval after a sync with the given outcome"""
+        if outcome == SYNC_CHANGED:
+            self.quiet_cycles = 0
+            self.error_cycles = 0
+            self.interval = self.min_interval
+            self.reason = 'change detected'
+            self.reason_code = 'change'
+        elif outcome == SYNC_ERROR:
+            self.error_cycles += 1
+            self.interval = min(self.max_interval, self.base_interval * self.backoff_factor ** self.error_cycles)
+            self.reason = f"API errors ({self.error_cycles} in a row)"
+            self.reason_code = 'errors'
+        elif self.error_cycles:
+            # First good cycle after errors: resume from the base interval
+            self.error_cycles = 0
+            self.interval = self.base_interval
+            self.reason = 'recovered from API errors'
+            self.reason_code = 'recovered'
+        else:
+            self.quiet_cycles += 1
+            self.interval = min(self.max_interval, self.interval * self.backoff_factor)
+            self.reason = f"no changes ({self.quiet_cycles} cycles)"
+            self.reason_code = 'quiet'
+        return self.interval
+
+
+class ReconfigureWorker:
+    """Runs firewall reconfigures in a background thread, coalescing bursts
+    
+    At most one reconfigure is in flight and one pending; further requests
+    while one is pending are folded into it. A failed reconfigure is retried
+    with exponential backoff until one succeeds, since the alias it was meant
+    to apply is already saved. The result of the last run is kept for
+    reporting in the next sync; on_finished (if set) is called after each run.
+    """
+    
+    def __init__(self, opnsense_api: 'OPNsenseAPI', retry_delay: float = 5, max_retry_delay: float = 300):
+        self.opnsense = opnsense_api
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._cond = threading.Condition()
+        self._pending = False
+        self._running = False
+        self._retry_at = None
+        self._thread = None
+        self.on_finished: Callable[[], None] = None
+        self.failures = 0
+        self.last_result = None
+        self.last_duration = 0.0
+        self.last_finished = 0.0
+        self.completed = 0
+        self.coalesced = 0
+    
+    def request(self) -> bool:
+        """Queue a reconfigure; returns False if it was coalesced into a pending one"""
+        with self._cond:
+            if self._pending:
+                self.coalesced += 1
+                metrics.inc('portmapper_reconfigures_total', target=self.opnsense.name, result='coalesced')
+                return False
+            self._pending = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='reconfigure', daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+            return True
+    
+    @property
+    def needs_retry(self) -> bool:
+        """Whether the last reconfigure failed and has not been retried successfully yet"""
+        with self._cond:
+            return self._retry_at is not None
+    
+    @property
+    def unapplied(self) -> bool:
+        """Whether saved alias changes may not be live yet (reconfigure queued, running or failed)"""
+        with self._cond:
+            return self._pending or self._running or self._retry_at is not None
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    if self._retry_at is None:
+                        self._cond.wait()
+                    elif time.monotonic() < self._retry_at:
+                        self._cond.wait(self._retry_at - time.monotonic())
+                    else:
+                        logger.info("🔁 Retrying failed reconfigure (attempt %d)", self.failures + 1,
+                                    extra={'target': self.opnsense.name})
+                        self._pending = True
+                self._pending = False
+                self._retry_at = None
+                self._running = True
             
-            # Update via setItem
-            url = f"{self.url}/api/firewall/alias/setItem/{alias_uuid}"
-            response = requests.post(
-                url,
-                auth=self.auth,
-                json=update_data,
-                verify=self.verify_ssl,
-                headers={'Content-Type': 'application/json'}
-            )
+            started = time.monotonic()
+            try:
+                with phase_timer('reconfigure', target=self.opnsense.name):
+                    result = self.opnsense.reconfigure_firewall()
+            except Exception as e:
+                logger.error("❌ Error during reconfigure: %s", e, extra={'target': self.opnsense.name})
+                result = False
+            metrics.inc('portmapper_reconfigures_total', target=self.opnsense.name, result='ok' if result else 'failed')
+            if not result:
+                metrics.inc('portmapper_errors_total', component='reconfigure')
             
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('result') == 'saved':
-                    return True
+            with self._cond:
+                self._running = False
+                if result:
+                    self.failures = 0
                 else:
-                    print(f"❌ Error: {result}")
-                    return False
-            
-            print(f"❌ HTTP {response.status_code}: {response.text}")
-            return False
+                    self.failures += 1
+                    delay = min(self.max_retry_delay, self.retry_delay * 2 ** (self.failures - 1))
+                    self._retry_at = time.monotonic() + delay
+                    logger.warning("🔁 Reconfigure failed %d time(s) in a row - retrying in %gs",
+                                   self.failures, delay, extra={'target': self.opnsense.name})
+                self.last_result = result
+                self.last_duration = time.monotonic() - started
+                self.last_finished = time.monotonic()
+                self.completed += 1
+                self._cond.notify_all()
             
-        except Exception as e:
-            print(f"❌ Error: {e}")
-            return False
+            if self.on_finished is not None:
+                try:
+                    self.on_finished()
+                except Exception as e:
+                    logger.error("❌ Error after reconfigure: %s", e, extra={'target': self.opnsense.name})
     
-    def reconfigure_firewall(self) -> bool:
-        """Apply firewall changes (reconfigure)"""
-        url = f"{self.url}/api/firewall/alias/reconfigure"
+    @property
+    def busy(self) -> bool:
+        with self._cond:
+            return self._pending or self._running
+    
+    def wait(self, timeout: float = None) -> bool:
+        """Wait until no reconfigure is pending or running; returns False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not (self._pending or self._running), timeout)
+    
+    def status(self) -> str:
+        """Human-readable status of the last/current reconfigure"""
+        with self._cond:
+            if self._running:
+                state = 'running' + (' (+1 pending)' if self._pending else '')
+            elif self._pending:
+                state = 'pending'
+            elif self.last_result is None:
+                return 'none yet'
+            else:
+                state = 'idle'
+            if self.last_result is None:
+                return state
+            outcome = 'ok' if self.last_result else 'failed'
+            ago = time.monotonic() - self.last_finished
+            status = f"{state}, last {outcome} in {self.last_duration:.1f}s ({ago:.0f}s ago)"
+            if self._retry_at is not None:
+                status += f", retry in {max(0.0, self._retry_at - time.monotonic()):.0f}s"
+            return status
+
+
+class StateStore:
+    """JSON state file for warm restarts, replaced atomically on every save
+    
+    load() returns {} for a missing, unreadable, stale or foreign file, so the
+    caller simply starts cold.
+    """
+    
+    VERSION = 1
+    
+    def __init__(self, path: str, max_age: float = 3600):
+        self.path = path
+        self.max_age = max_age
+    
+    def load(self) -> Dict:
         try:
-            response = requests.post(url, auth=self.auth, verify=self.verify_ssl)
-            if response.status_code == 200:
-                print("✅ Firewall reconfigured")
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning("⚠️  State file %s unreadable, starting cold: %s", self.path, e)
+            return {}
+        
+        if not isinstance(state, dict) or state.get('version') != self.VERSION \
+                or not isinstance(state.get('saved_at'), (int, float)):
+            logger.warning("⚠️  State file %s has an unknown format, starting cold", self.path)
+            return {}
+        age = time.time() - state['saved_at']
+        if self.max_age > 0 and not 0 <= age <= self.max_age:
+            logger.warning("⚠️  State file %s is stale (%.0fs old), starting cold", self.path, age)
+            return {}
+        return state
+    
+    def save(self, state: Dict):
+        """Write via a temp file in the same directory and rename it over the old one"""
+        state = dict(state, version=self.VERSION, saved_at=time.time())
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.state-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(state, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+class CircuitBreaker:
+    """Stops calling an upstream after repeated failures
+    
+    After `threshold` consecutive failures the breaker opens and allow() returns
+    False for `cooldown` seconds. Then a single trial call is let through; its
+    success closes the breaker, its failure opens it for another cooldown.
+    """
+    
+    def __init__(self, name: str, threshold: int = 3, cooldown: float = 60):
+        self.name = name
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            return 'half-open' if self._trial else 'open'
+    
+    def retry_in(self) -> float:
+        """Seconds until the next trial call is allowed (0 if closed)"""
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self._opened_at + self.cooldown - time.monotonic())
+    
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
                 return True
-            print(f"⚠️  Reconfigure failed: {response.status_code} - {response.text}")
-            return False
-        except Exception as e:
-            print(f"❌ Error beim Reconfigure: {e}")
-            return False
+            if self._trial or time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self._trial = True
+            return True
+    
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial = False
+        metrics.set('portmapper_circuit_open', 0, upstream=self.name)
+    
+    def record_failure(self) -> bool:
+        """Count a failure; returns True if this opened (or re-opened) the breaker"""
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.failures < self.threshold:
+                return False
+            self._opened_at = time.monotonic()
+        metrics.set('portmapper_circuit_open', 1, upstream=self.name)
+        return True
 
 
-class PortMapperSync:
-    def __init__(self, ptero_api: PterodactylAPI, opnsense_api: OPNsenseAPI, excluded_ports: Set[int] = None):
-        """Initialize Sync Manager"""
-        self.ptero = ptero_api
+def port_fingerprint(ports: Iterable[int]) -> str:
+    """Stable hash of a port set, used to detect unchanged cycles"""
+    return hashlib.sha256(PortSet(ports).to_bytes()).hexdigest()
+
+
+class SyncTarget:
+    """One firewall/alias a Pterodactyl snapshot is pushed to, with its own diff state"""
+    
+    # Allocations behind added ports are listed individually at info level up to this many ports
+    LIST_ALLOCATIONS = 20
+    
+    def __init__(self, opnsense_api: OPNsenseAPI, verify_every: int = 10, async_reconfigure: bool = True,
+                 label: bool = False, read_deadline: float = 30, breaker: CircuitBreaker = None):
         self.opnsense = opnsense_api
-        self.excluded_ports = excluded_ports or set()
+        self.reconfigurer = ReconfigureWorker(opnsense_api)
+        self.async_reconfigure = async_reconfigure
+        self.logger = logging.LoggerAdapter(logger, {'target': opnsense_api.name} if label else {})
+        
+        # Fingerprints of the last applied port set and the last observed alias content.
+        # While Pterodactyl is unchanged the alias read is skipped, except every
+        # verify_every cycles to catch edits made directly on the firewall.
+        self.verify_every = max(1, verify_every)
+        self._last_applied_fingerprint = ''
+        self._last_applied_ports = PortSet()
+        self._last_alias_fingerprint = ''
+        self._cycles_since_verify = 0
+        
+        # Held while a sync for this target runs; a target that is still busy
+        # from an earlier (timed out) cycle is skipped instead of piling up
+        self.busy = threading.Lock()
+        
+        # Alias reads run on their own thread so they can overlap the Pterodactyl
+        # fetch and be abandoned after read_deadline
+        self.read_deadline = read_deadline
+        self.breaker = breaker or CircuitBreaker(opnsense_api.name)
+        self.last_outcome = None
+        self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='alias-read')
+        self._pending_read = None
     
-    def sync(self):
-        """Perform synchronization"""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print("\n" + "=" * 70)
-        print(f"🔄 Sync started: {timestamp}")
-        print("=" * 70)
+    @property
+    def state_key(self) -> str:
+        return f"{self.opnsense.url}#{self.opnsense.alias_name}"
+    
+    def export_state(self) -> Dict:
+        """Diff state and alias cache of this target, for the state file"""
+        state = self.opnsense.export_alias_cache()
+        state.update({
+            'applied_ports': compact_port_ranges(self._last_applied_ports),
+            'applied_fingerprint': self._last_applied_fingerprint,
+            'alias_fingerprint': self._last_alias_fingerprint,
+            'cycles_since_verify': self._cycles_since_verify,
+        })
+        return state
+    
+    def restore_state(self, state: Dict) -> bool:
+        """Restore exported state; rejected if the port list does not match its fingerprint"""
+        try:
+            ports, _ = split_port_entries(state.get('applied_ports', []))
+            if port_fingerprint(ports) != state.get('applied_fingerprint'):
+                return False
+            self.opnsense.restore_alias_cache(state.get('alias_uuid', ''), state.get('alias_meta', {}))
+            self._last_applied_ports = ports
+            self._last_applied_fingerprint = state['applied_fingerprint']
+            self._last_alias_fingerprint = str(state.get('alias_fingerprint', ''))
+            self._cycles_since_verify = int(state.get('cycles_since_verify', 0))
+            return True
+        except (AttributeError, TypeError, ValueError):
+            return False
+    
+    def should_prefetch(self) -> bool:
+        """Whether the alias is (likely) read this cycle, so it pays to read it alongside Pterodactyl
         
-        # 1. Collect all ports from Pterodactyl
-        print("\n📡 Fetching Pterodactyl servers...")
-        servers = self.ptero.get_all_servers()
-        allocations = self.ptero.extract_allocations(servers)
-        pterodactyl_ports = {alloc['port'] for alloc in allocations}
+        True on a cold start, when a verify is due, and right after a change
+        (allocations tend to change in bursts).
+        """
+        return (not self._last_applied_fingerprint
+                or self._cycles_since_verify >= self.verify_every - 1
+                or self.last_outcome == SYNC_CHANGED)
+    
+    def _read_alias(self) -> PortSet:
+        with phase_timer('opnsense_read', target=self.opnsense.name):
+            return self.opnsense.read_alias_ports()
+    
+    def start_alias_read(self) -> Future:
+        """Start reading the alias in the background
         
-        # Filter out excluded ports
-        if self.excluded_ports:
-            blocked_ports = pterodactyl_ports & self.excluded_ports
-            if blocked_ports:
-                print(f"⚠️  WARNING: {len(blocked_ports)} protected ports found and ignored:")
-                for port in sorted(blocked_ports):
-                    print(f"   🚫 Port {port} (in EXCLUDED_PORTS)")
-            pterodactyl_ports = pterodactyl_ports - self.excluded_ports
+        A read that is still running (e.g. abandoned after its deadline) is
+        reused instead of queueing another one behind it.
+        """
+        if self._pending_read is None or self._pending_read.done():
+            self._pending_read = self._reader.submit(profiler.wrap(self._read_alias))
+        return self._pending_read
+    
+    def _skip_unchanged(self, fingerprint: str, alias_read: Future = None) -> bool:
+        """Skip the alias read if nothing changed since the last applied state and no verify is due"""
+        if alias_read is not None or fingerprint != self._last_applied_fingerprint \
+                or self._cycles_since_verify >= self.verify_every - 1:
+            return False
+        self._cycles_since_verify += 1
+        metrics.inc('portmapper_skipped_total', target=self.opnsense.name, reason='unchanged')
+        self.logger.debug("✅ Pterodactyl unchanged since last sync - OPNsense check skipped "
+                          "(verify in %d cycles)", self.verify_every - self._cycles_since_verify)
+        return True
+    
+    def _await_read(self, alias_read: Future):
+        """Result of an alias read, raising AliasReadError after read_deadline"""
+        try:
+            result = alias_read.result(timeout=self.read_deadline)
+        except FutureTimeout:
+            raise AliasReadError(f"No alias read result within {self.read_deadline:g}s") from None
+        self._cycles_since_verify = 0
+        return result
+    
+    def sync(self, pterodactyl_ports: PortSet, fingerprint: str, snapshot: PortSnapshot,
+             excluded_ports: PortSet, resolve_names: Callable[[List[Allocation]], None] = None,
+             alias_read: Future = None) -> str:
+        """Diff and update this target's alias against the Pterodactyl port set
         
-        print(f"✓ {len(servers)} servers, {len(allocations)} allocations found")
-        print(f"📋 Pterodactyl Ports: {sorted(pterodactyl_ports)}")
+        alias_read is an alias read started earlier with start_alias_read(); if
+        given, its result is used (and the unchanged-skip does not apply).
+        Raises AliasReadError if the alias can't be read within read_deadline.
+        """
+        if self._skip_unchanged(fingerprint, alias_read):
+            return SYNC_UNCHANGED
         
         # 2. Collect all ports from OPNsense
-        print("\n🔍 Fetching OPNsense alias...")
-        opnsense_ports_raw = self.opnsense.get_alias_ports()
+        if alias_read is None:
+            self.logger.debug("🔍 Fetching OPNsense alias...")
+            alias_read = self.start_alias_read()
+        else:
+            self.logger.debug("🔍 Fetching OPNsense alias... (read in parallel with Pterodactyl)")
+        opnsense_ports_raw = self._await_read(alias_read)
+        metrics.set('portmapper_alias_ports', len(opnsense_ports_raw), target=self.opnsense.name)
+        
+        alias_fingerprint = port_fingerprint(opnsense_ports_raw)
+        if (fingerprint == self._last_applied_fingerprint
+                and alias_fingerprint != self._last_alias_fingerprint):
+            self.logger.warning("⚠️  Alias was modified outside of the port mapper")
+        self._last_alias_fingerprint = alias_fingerprint
         
         # Check for forbidden ports in alias
-        forbidden_in_alias = set()
-        if self.excluded_ports:
-            forbidden_in_alias = opnsense_ports_raw & self.excluded_ports
+        forbidden_in_alias = PortSet()
+        if excluded_ports:
+            forbidden_in_alias = opnsense_ports_raw & excluded_ports
             if forbidden_in_alias:
-                print(f"⚠️  WARNING: {len(forbidden_in_alias)} protected ports found in alias:")
-                for port in sorted(forbidden_in_alias):
-                    print(f"   🚫 Port {port} will be removed (in EXCLUDED_PORTS)")
+                self.logger.warning("⚠️  %d protected ports found in alias, will be removed (in EXCLUDED_PORTS): %s",
+                                    len(forbidden_in_alias), PortList(forbidden_in_alias))
         
         # Clean up OPNsense ports (without protected ports)
-        opnsense_ports = opnsense_ports_raw - self.excluded_ports
+        opnsense_ports = opnsense_ports_raw - excluded_ports
         
-        print(f"✓ {len(opnsense_ports)} ports found in alias")
-        print(f"📋 OPNsense Ports: {sorted(opnsense_ports)}")
+        self.logger.debug("✓ %d ports found in alias", len(opnsense_ports))
+        with tracer.span('report', target=self.opnsense.name):
+            self.logger.debug("📋 OPNsense Ports: %s", PortList(opnsense_ports, limit=0))
         
         # 3. Check for differences (including forbidden ports to remove)
-        print("\n🔍 Comparing ports...")
-        ports_to_add = pterodactyl_ports - opnsense_ports
-        ports_to_remove = (opnsense_ports - pterodactyl_ports) | forbidden_in_alias
+        with phase_timer('diff', target=self.opnsense.name):
+            ports_to_add = pterodactyl_ports - opnsense_ports
+            ports_to_remove = (opnsense_ports - pterodactyl_ports) | forbidden_in_alias
         
         # If no changes and no forbidden ports
-        if not ports_to_add and not ports_to_remove:
-            print("✅ No differences - all ports are in sync!")
-            print("\n" + "=" * 70)
-            print(f"✅ Sync completed: {timestamp}")
-            print(f"📊 Status: {len(pterodactyl_ports)} active ports")
-            print("=" * 70)
-            return
+        if not ports_to_add and not ports_to_remove and not self.opnsense.layout_outdated:
+            self.logger.debug("✅ No differences - all ports are in sync!")
+            self._last_applied_fingerprint = fingerprint
+            self._last_applied_ports = pterodactyl_ports
+            return SYNC_UNCHANGED
         
-        print("⚠️  Differences found:")
+        if not ports_to_add and not ports_to_remove:
+            self.logger.info("🧱 Alias layout (parent/shard aliases) needs an update")
         if ports_to_add:
-            print(f"\n  ➕ Add: {sorted(ports_to_add)}")
-            for allocation in allocations:
-                if allocation['port'] in ports_to_add:
-                    print(f"     • {allocation['port']} - {allocation['server_name']}")
+            self.logger.info("➕ Add %d ports: %s", len(ports_to_add), PortList(ports_to_add))
+            self._log_added_allocations(ports_to_add, snapshot, resolve_names)
         
         if ports_to_remove:
             # Differentiate between normal and protected ports
             normal_remove = ports_to_remove - forbidden_in_alias
             if normal_remove:
-                print(f"\n  ➖ Remove (orphaned): {sorted(normal_remove)}")
+                self.logger.info("➖ Remove %d orphaned ports: %s", len(normal_remove), PortList(normal_remove))
             if forbidden_in_alias:
-                print(f"\n  🚫 Remove (protected): {sorted(forbidden_in_alias)}")
+                self.logger.info("🚫 Remove %d protected ports: %s", len(forbidden_in_alias),
+                                 PortList(forbidden_in_alias))
         
         # 5. Update and Reconfigure
-        print("\n💾 Updating alias...")
-        if self.opnsense.update_alias_ports(pterodactyl_ports, allocations):
-            print("✅ Alias successfully updated")
+        self.logger.debug("💾 Updating alias...")
+        with phase_timer('set_item', target=self.opnsense.name):
+            updated = self.opnsense.update_alias_ports(pterodactyl_ports)
+        if updated:
+            self.logger.info("✅ Alias updated: +%d -%d ports", len(ports_to_add), len(ports_to_remove))
+            metrics.inc('portmapper_ports_added_total', len(ports_to_add), target=self.opnsense.name)
+            metrics.inc('portmapper_ports_removed_total', len(ports_to_remove), target=self.opnsense.name)
+            self._last_applied_fingerprint = fingerprint
+            self._last_applied_ports = pterodactyl_ports
+            self._last_alias_fingerprint = fingerprint
+            self._apply_firewall_changes(self.opnsense.content_changed)
+            return SYNC_CHANGED
+        
+        self.logger.error("❌ Error updating alias '%s'", self.opnsense.alias_name)
+        if self.opnsense.content_changed:
+            # Part of the update was saved (e.g. some shards), so it must still be applied
+            self._apply_firewall_changes(True)
+        self._last_applied_fingerprint = ''
+        return SYNC_ERROR
+    
+    def _apply_firewall_changes(self, content_changed: bool):
+        """Queue a reconfigure unless the write left the alias content unchanged"""
+        if not content_changed:
+            self.logger.info("ℹ️  Alias content unchanged - no reconfigure needed")
+            return
+        
+        if not self.reconfigurer.request():
+            self.logger.info("🔄 Reconfigure already pending - coalesced")
+        elif self.async_reconfigure:
+            self.logger.info("🔄 Reconfigure queued")
+        
+        if not self.async_reconfigure:
+            self.reconfigurer.wait()
+    
+    def _log_added_allocations(self, ports: PortSet, snapshot: PortSnapshot,
+                               resolve_names: Callable[[List[Allocation]], None] = None):
+        """List the allocations behind added ports, at info level for small changes, else at debug"""
+        level = logging.INFO if len(ports) <= self.LIST_ALLOCATIONS else logging.DEBUG
+        if not self.logger.isEnabledFor(level):
+            return
+        added = snapshot.allocations_for(ports)
+        if resolve_names:
+            resolve_names(added)
+        for allocation in added:
+            self.logger.log(level, "   • %s - %s", allocation.port, allocation.server_name)
+
+
+def alias_group_key(allocation: Allocation, group_by: str) -> str:
+    """Alias name suffix of an allocation's group: 'node3' or its IP as '10_0_1_5'"""
+    if group_by == 'node':
+        return f"node{allocation.node_id}"
+    return re.sub(r'[^0-9A-Za-z]', '_', allocation.ip)
+
+
+def groups_fingerprint(groups: Dict[str, PortSet]) -> str:
+    """Stable hash of per-alias port sets"""
+    digest = hashlib.sha256()
+    for name in sorted(groups):
+        digest.update(name.encode() + b'\0' + groups[name].to_bytes())
+    return digest.hexdigest()
+
+
+class GroupedSyncTarget(SyncTarget):
+    """Sync target with one alias per Pterodactyl node or allocation IP
+    
+    Ports are split into <alias_name>_<group> aliases (e.g. pterodactyl_ports_node3
+    or pterodactyl_ports_10_0_1_5), each diffed on its own. Only changed aliases
+    are written (in parallel, missing ones are created) and the firewall is
+    reconfigured once. Aliases of groups that disappear are emptied, not deleted,
+    as NAT rules may still reference them.
+    """
+    
+    GROUP_BY = ('node', 'ip')
+    
+    # OPNsense alias names are limited to 32 characters
+    MAX_ALIAS_NAME = 32
+    
+    def __init__(self, opnsense_api: OPNsenseAPI, *args, group_by: str = 'node', **kwargs):
+        if group_by not in self.GROUP_BY:
+            raise ValueError(f"Unknown alias grouping '{group_by}' (expected one of {', '.join(self.GROUP_BY)})")
+        super().__init__(opnsense_api, *args, **kwargs)
+        self.group_by = group_by
+        self._group_apis: Dict[str, OPNsenseAPI] = {}
+        self._last_applied_groups: Dict[str, PortSet] = {}
+        self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='group-alias')
+    
+    def alias_name_for(self, group: str) -> str:
+        name = f"{self.opnsense.alias_name}_{group}"
+        if len(name) > self.MAX_ALIAS_NAME:
+            name = f"{self.opnsense.alias_name}_{hashlib.sha1(group.encode()).hexdigest()[:8]}"
+        return name
+    
+    def _group_api(self, name: str) -> OPNsenseAPI:
+        api = self._group_apis.get(name)
+        if api is None:
+            base = self.opnsense
+            api = OPNsenseAPI(base.url, *base.auth, name, base.verify_ssl, base.transport, base.cache_ttl,
+                              base.use_ranges, base.timeout, name=base.name)
+            self._group_apis[name] = api
+        return api
+    
+    def group_ports(self, snapshot: PortSnapshot, excluded_ports: PortSet) -> Dict[str, PortSet]:
+        """Ports per group alias name; a port shared by several groups is in each of them"""
+        groups: Dict[str, PortSet] = {}
+        names: Dict[str, str] = {}
+        for port, allocations in snapshot.by_port.items():
+            if port in excluded_ports:
+                continue
+            for allocation in allocations:
+                key = alias_group_key(allocation, self.group_by)
+                name = names.get(key) or names.setdefault(key, self.alias_name_for(key))
+                ports = groups.get(name)
+                if ports is None:
+                    ports = groups[name] = PortSet()
+                ports.add(port)
+        return groups
+    
+    def export_state(self) -> Dict:
+        """Per-alias diff state of this target, for the state file"""
+        return {
+            'applied_groups': {name: compact_port_ranges(ports) for name, ports in self._last_applied_groups.items()},
+            'applied_fingerprint': self._last_applied_fingerprint,
+            'cycles_since_verify': self._cycles_since_verify,
+        }
+    
+    def restore_state(self, state: Dict) -> bool:
+        """Restore exported state; rejected if the alias port lists do not match their fingerprint"""
+        try:
+            groups = {name: split_port_entries(entries)[0] for name, entries in state['applied_groups'].items()}
+            if groups_fingerprint(groups) != state.get('applied_fingerprint'):
+                return False
+            for name in groups:
+                self._group_api(name)
+            self._last_applied_groups = groups
+            self._last_applied_fingerprint = state['applied_fingerprint']
+            self._cycles_since_verify = int(state.get('cycles_since_verify', 0))
+            return True
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return False
+    
+    def _read_groups(self, names: List[str]) -> Dict[str, PortSet]:
+        """Read the given group aliases in parallel (None for aliases that don't exist yet)"""
+        apis = [self._group_api(name) for name in names]
+        return dict(zip(names, self._pool.map(profiler.wrap(OPNsenseAPI.read_existing_alias_ports), apis)))
+    
+    def _read_alias(self) -> Dict[str, PortSet]:
+        """Read every group alias known so far; new groups are read once the snapshot shows them"""
+        with phase_timer('opnsense_read', target=self.opnsense.name):
+            return self._read_groups(list(self._group_apis))
+    
+    def sync(self, pterodactyl_ports: PortSet, fingerprint: str, snapshot: PortSnapshot,
+             excluded_ports: PortSet, resolve_names: Callable[[List[Allocation]], None] = None,
+             alias_read: Future = None) -> str:
+        """Diff and update every group alias against its share of the snapshot"""
+        groups = self.group_ports(snapshot, excluded_ports)
+        fingerprint = groups_fingerprint(groups)
+        if self._skip_unchanged(fingerprint, alias_read):
+            return SYNC_UNCHANGED
+        
+        # 2. Collect the ports of every group alias from OPNsense
+        names = sorted(set(groups) | set(self._last_applied_groups))
+        if alias_read is None:
+            self.logger.debug("🔍 Fetching %d OPNsense %s aliases...", len(names), self.group_by)
+            alias_read = self.start_alias_read()
+        else:
+            self.logger.debug("🔍 Fetching %d OPNsense %s aliases... (read in parallel with Pterodactyl)",
+                              len(names), self.group_by)
+        current = self._await_read(alias_read)
+        unread = [name for name in names if name not in current]
+        if unread:
+            with phase_timer('opnsense_read', target=self.opnsense.name):
+                current.update(self._read_groups(unread))
+        metrics.set('portmapper_alias_ports', sum(len(ports or ()) for ports in current.values()),
+                    target=self.opnsense.name)
+        
+        # 3. Check for differences per alias (protected ports are never wanted, so they get removed)
+        changes: Dict[str, Tuple[PortSet, PortSet, PortSet]] = {}
+        with phase_timer('diff', target=self.opnsense.name):
+            for name in names:
+                wanted = groups.get(name, PortSet())
+                existing = current.get(name)
+                if existing is None:
+                    changes[name] = (wanted, wanted, PortSet())
+                    continue
+                ports_to_add = wanted - existing
+                ports_to_remove = existing - wanted
+                if ports_to_add or ports_to_remove:
+                    changes[name] = (wanted, ports_to_add, ports_to_remove)
+        
+        if not changes:
+            self.logger.debug("✅ No differences - all %d aliases are in sync!", len(names))
+            self._last_applied_fingerprint = fingerprint
+            self._last_applied_groups = groups
+            return SYNC_UNCHANGED
+        
+        all_added = PortSet()
+        for name, (wanted, ports_to_add, ports_to_remove) in changes.items():
+            all_added.update(ports_to_add)
+            if current.get(name) is None:
+                self.logger.info("🆕 Create %s with %d ports: %s", name, len(wanted), PortList(wanted))
+                continue
+            if ports_to_add:
+                self.logger.info("➕ Add %d ports to %s: %s", len(ports_to_add), name, PortList(ports_to_add))
+            if ports_to_remove:
+                self.logger.info("➖ Remove %d ports from %s: %s", len(ports_to_remove), name,
+                                 PortList(ports_to_remove))
+        self._log_added_allocations(all_added, snapshot, resolve_names)
+        
+        # 5. Update the changed aliases, then reconfigure once
+        self.logger.debug("💾 Updating %d of %d aliases...", len(changes), len(names))
+        with phase_timer('set_item', target=self.opnsense.name):
+            results = dict(zip(changes, self._pool.map(
+                profiler.wrap(lambda name: self._group_api(name).write_alias_ports(changes[name][0])), changes
+            )))
+        
+        applied = dict(groups)
+        for name, ok in results.items():
+            if ok:
+                metrics.inc('portmapper_ports_added_total', len(changes[name][1]), target=self.opnsense.name)
+                metrics.inc('portmapper_ports_removed_total', len(changes[name][2]), target=self.opnsense.name)
+            else:
+                # Keep failed aliases of vanished groups around so they are retried
+                applied.setdefault(name, PortSet())
+        self._last_applied_groups = applied
+        
+        failed = [name for name, ok in results.items() if not ok]
+        self.logger.info("✅ %d of %d aliases updated", len(results) - len(failed), len(names))
+        self._apply_firewall_changes(any(self._group_apis[name].content_changed for name in results))
+        if failed:
+            self.logger.error("❌ Error updating aliases: %s", ', '.join(failed))
+            self._last_applied_fingerprint = ''
+            return SYNC_ERROR
+        self._last_applied_fingerprint = fingerprint
+        return SYNC_CHANGED
+
+
+class PortMapperSync:
+    def __init__(self, ptero_api: PterodactylAPI, opnsense_api, excluded_ports: Set[int] = None,
+                 verify_every: int = 10, async_reconfigure: bool = True, target_deadline: float = 120,
+                 state_store: StateStore = None, fetch_deadline: float = 120, read_deadline: float = 30,
+                 breaker_threshold: int = 3, breaker_cooldown: float = 60, alias_group_by: str = ''):
+        """Initialize Sync Manager
+        
+        opnsense_api can be a single OPNsenseAPI or a list of them; each one is
+        synced in parallel from the same Pterodactyl snapshot. With a state_store
+        the diff state is saved after every sync and can be restored on startup.
+        
+        The Pterodactyl fetch and (when due) the alias reads run concurrently,
+        bounded by fetch_deadline and read_deadline. Each upstream has a circuit
+        breaker that skips it for breaker_cooldown seconds after
+        breaker_threshold failed cycles in a row.
+        
+        With alias_group_by ('node' or 'ip') every target keeps one alias per
+        Pterodactyl node or allocation IP instead of a single alias.
+        """
+        apis = opnsense_api if isinstance(opnsense_api, (list, tuple)) else [opnsense_api]
+        self.ptero = ptero_api
+        self.opnsense = apis[0]
+        self.excluded_ports = PortSet(excluded_ports or ())
+        target_class, group_options = SyncTarget, {}
+        if alias_group_by:
+            target_class, group_options = GroupedSyncTarget, {'group_by': alias_group_by}
+        self.targets = [
+            target_class(api, verify_every, async_reconfigure, label=len(apis) > 1, read_deadline=read_deadline,
+                         breaker=CircuitBreaker(api.name, breaker_threshold, breaker_cooldown), **group_options)
+            for api in apis
+        ]
+        self.target_deadline = target_deadline
+        self.fetch_deadline = fetch_deadline
+        self.ptero_breaker = CircuitBreaker('pterodactyl', breaker_threshold, breaker_cooldown)
+        self._fetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pterodactyl')
+        self._fetch = None
+        self.scheduler = None
+        self._next_interval = None
+        self._interval_logged = False
+        self.state_store = state_store
+        self._state_lock = threading.Lock()
+        self._last_sync = None
+        if state_store:
+            for target in self.targets:
+                target.reconfigurer.on_finished = self._save_state
+        self._blocked_ports = PortSet()
+        
+        # Long-lived pool: a hung target must not block the next cycle's shutdown of a `with` block
+        self._executor = ThreadPoolExecutor(max_workers=len(self.targets), thread_name_prefix='target') \
+            if len(self.targets) > 1 else None
+    
+    def sync(self) -> str:
+        """Perform synchronization, returns SYNC_CHANGED, SYNC_UNCHANGED or SYNC_ERROR"""
+        started = time.perf_counter()
+        outcome = SYNC_ERROR
+        self._next_interval = None
+        self._interval_logged = False
+        profiler.begin_cycle()
+        tracer.begin_cycle()
+        try:
+            outcome = self._sync_once()
+            return outcome
+        finally:
+            if self.scheduler is not None and self._next_interval is None:
+                self._schedule(outcome)
+            metrics.observe('portmapper_sync_duration_seconds', time.perf_counter() - started)
+            metrics.inc('portmapper_syncs_total', outcome=outcome)
+            summary = {'outcome': outcome, 'targets': {t.opnsense.name: t.last_outcome for t in self.targets}}
+            try:
+                profile_path = profiler.end_cycle()
+                if profile_path:
+                    summary['profile'] = profile_path
+                    logger.info("🔬 Cycle profile written to %s", profile_path)
+            except OSError as e:
+                logger.warning("⚠️  Could not write cycle profile: %s", e)
+            tracer.end_cycle(**summary)
+    
+    def _sync_once(self) -> str:
+        started = time.perf_counter()
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        logger.debug("🔄 Sync started: %s", timestamp)
+        
+        # 1. Collect all ports from Pterodactyl
+        if self._fetch is not None and not self._fetch.done():
+            logger.warning("⏳ Previous Pterodactyl fetch still running - sync skipped")
+            return SYNC_ERROR
+        if not self.ptero_breaker.allow():
+            logger.warning("⛔ Pterodactyl circuit open after %d failed fetches - sync skipped (retry in %.0fs)",
+                           self.ptero_breaker.failures, self.ptero_breaker.retry_in())
+            return SYNC_ERROR
+        
+        logger.debug("📡 Fetching Pterodactyl servers...")
+        self._fetch = self._fetch_executor.submit(profiler.wrap(self._fetch_snapshot))
+        
+        # Alias reads that are due run alongside, unless the last panel fetch failed
+        # (their result would most likely be thrown away again)
+        alias_reads = {} if self.ptero_breaker.failures else {
+            target: target.start_alias_read()
+            for target in self.targets
+            if target.should_prefetch() and target.breaker.state == 'closed' and not target.busy.locked()
+        }
+        try:
+            snapshot = self._fetch.result(timeout=self.fetch_deadline)
+        except (IncompleteSnapshotError, FutureTimeout, requests.RequestException,
+                ValueError, KeyError, TypeError, AttributeError) as e:
+            metrics.inc('portmapper_errors_total', component='pterodactyl')
+            if isinstance(e, FutureTimeout):
+                logger.error("⏱️  No Pterodactyl snapshot within %gs, sync aborted - alias left unchanged",
+                             self.fetch_deadline)
+            elif isinstance(e, (KeyError, TypeError, AttributeError)):
+                logger.error("❌ Malformed Pterodactyl response, sync aborted - alias left unchanged: %s: %s",
+                             type(e).__name__, e)
+            else:
+                logger.error("❌ Incomplete Pterodactyl snapshot, sync aborted - alias left unchanged: %s", e)
+            if self.ptero_breaker.record_failure():
+                logger.warning("⛔ Pterodactyl circuit opened for %gs", self.ptero_breaker.cooldown)
+            return SYNC_ERROR
+        self.ptero_breaker.record_success()
+        pterodactyl_ports = snapshot.ports
+        
+        # Filter out excluded ports
+        if self.excluded_ports:
+            blocked_ports = pterodactyl_ports & self.excluded_ports
+            if blocked_ports:
+                # Warned about once per change, not on every cycle
+                level = logging.WARNING if blocked_ports != self._blocked_ports else logging.DEBUG
+                logger.log(level, "⚠️  %d protected ports found and ignored (in EXCLUDED_PORTS): %s",
+                           len(blocked_ports), PortList(blocked_ports))
+            self._blocked_ports = blocked_ports
+            pterodactyl_ports = pterodactyl_ports - self.excluded_ports
+        
+        logger.debug("✓ %s, %d allocations found", self.ptero.last_fetch_summary, snapshot.allocation_count)
+        metrics.set('portmapper_allocations', snapshot.allocation_count)
+        metrics.set('portmapper_ports', len(pterodactyl_ports))
+        with tracer.span('report'):
+            logger.debug("📋 Pterodactyl Ports: %s", PortList(pterodactyl_ports, limit=0))
+        
+        fingerprint = port_fingerprint(pterodactyl_ports)
+        outcomes = self._sync_targets(pterodactyl_ports, fingerprint, snapshot, alias_reads)
+        self._save_state(timestamp)
+        
+        # A change on any firewall wins, so one failing firewall does not slow down
+        # the others; the cycle only counts as failed if no firewall could be synced
+        if SYNC_CHANGED in outcomes:
+            outcome = SYNC_CHANGED
+        elif all(result in (SYNC_ERROR, SYNC_SKIPPED) for result in outcomes):
+            outcome = SYNC_ERROR
+        else:
+            outcome = SYNC_UNCHANGED
+        failed = sum(result == SYNC_ERROR for result in outcomes)
+        self._log_summary(outcome, failed, time.perf_counter() - started, snapshot, pterodactyl_ports)
+        return outcome
+    
+    def _schedule(self, outcome: str) -> float:
+        """Pick the wait before the next sync (run_continuous only), once per cycle"""
+        self._next_interval = self.scheduler.next_interval(outcome)
+        metrics.set('portmapper_sync_interval_seconds', self._next_interval)
+        for reason in self.scheduler.REASONS:
+            metrics.set('portmapper_sync_interval_reason', int(reason == self.scheduler.reason_code), reason=reason)
+        return self._next_interval
+    
+    def _fetch_snapshot(self) -> PortSnapshot:
+        with phase_timer('pterodactyl_fetch'):
+            return PortSnapshot(self.ptero.iter_allocations())
+    
+    def restore_state(self, state: Dict) -> int:
+        """Seed the targets from a loaded state file, returns the number restored"""
+        saved_targets = state.get('targets')
+        if not isinstance(saved_targets, dict):
+            return 0
+        restored = 0
+        for target in self.targets:
+            saved = saved_targets.get(target.state_key)
+            if not isinstance(saved, dict):
+                continue
+            if target.restore_state(saved):
+                restored += 1
+                if saved.get('reconfigure_pending'):
+                    # The saved alias may never have been applied to the firewall rules
+                    target.logger.info("🔁 Reconfigure was still pending or had failed before the restart - retrying")
+                    target.reconfigurer.request()
+            else:
+                target.logger.warning("⚠️  Saved state is inconsistent - starting cold")
+        if restored:
+            self._last_sync = state.get('last_sync', '')
+            age = time.time() - state['saved_at']
+            logger.info("♻️  Restored state of %d/%d firewall(s) from %s (%.0fs ago)",
+                        restored, len(self.targets), state.get('last_sync', 'unknown'), age)
+        return restored
+    
+    def _save_state(self, timestamp: str = None):
+        """Write the current diff state to the state file, if configured
+        
+        Also called from the reconfigure workers once a reconfigure finished, so
+        the file never claims a queued or failed reconfigure as applied.
+        """
+        if not self.state_store:
+            return
+        with self._state_lock:
+            if timestamp is not None:
+                self._last_sync = timestamp
+            elif self._last_sync is None:
+                return
+            state = {
+                'last_sync': self._last_sync,
+                'targets': {
+                    target.state_key: dict(target.export_state(), reconfigure_pending=target.reconfigurer.unapplied)
+                    for target in self.targets
+                },
+            }
+            try:
+                self.state_store.save(state)
+            except OSError as e:
+                logger.warning("⚠️  Could not write state file %s: %s", self.state_store.path, e)
+    
+    def _sync_target(self, target: SyncTarget, pterodactyl_ports: PortSet, fingerprint: str,
+                     snapshot: PortSnapshot, alias_read: Future = None) -> str:
+        """Sync one target, isolating its failures from the others
+        
+        Returns SYNC_SKIPPED if the target is still busy or its circuit is open;
+        that failure was already counted when it happened.
+        """
+        if not target.busy.acquire(blocking=False):
+            target.logger.warning("⏳ Previous sync for this firewall still running - skipped")
+            metrics.inc('portmapper_skipped_total', target=target.opnsense.name, reason='busy')
+            target.last_outcome = SYNC_SKIPPED
+            return SYNC_SKIPPED
+        try:
+            if not target.breaker.allow():
+                target.logger.warning("⛔ Circuit open after %d failed syncs - skipped (retry in %.0fs)",
+                                      target.breaker.failures, target.breaker.retry_in())
+                metrics.inc('portmapper_skipped_total', target=target.opnsense.name, reason='circuit_open')
+                target.last_outcome = SYNC_SKIPPED
+                return SYNC_SKIPPED
+            try:
+                outcome = target.sync(
+                    pterodactyl_ports, fingerprint, snapshot, self.excluded_ports, self.ptero.resolve_server_names,
+                    alias_read
+                )
+            except Exception as e:
+                target.logger.error("❌ Error during sync: %s", e)
+                outcome = SYNC_ERROR
             
-            print("\n🔄 Applying firewall changes...")
-            self.opnsense.reconfigure_firewall()
+            target.last_outcome = outcome
+            if outcome != SYNC_ERROR:
+                target.breaker.record_success()
+            elif target.breaker.record_failure():
+                target.logger.warning("⛔ Circuit opened for %gs", target.breaker.cooldown)
+        finally:
+            target.busy.release()
+        
+        metrics.inc('portmapper_target_syncs_total', target=target.opnsense.name, outcome=outcome)
+        if outcome == SYNC_ERROR:
+            metrics.inc('portmapper_errors_total', component='opnsense')
+        return outcome
+    
+    def _sync_targets(self, pterodactyl_ports: PortSet, fingerprint: str, snapshot: PortSnapshot,
+                      alias_reads: Dict[SyncTarget, Future] = None) -> List[str]:
+        """Push the snapshot to all targets, in parallel if there are several"""
+        alias_reads = alias_reads or {}
+        if self._executor is None:
+            target = self.targets[0]
+            return [self._sync_target(target, pterodactyl_ports, fingerprint, snapshot, alias_reads.get(target))]
+        
+        futures = {
+            self._executor.submit(
+                profiler.wrap(self._sync_target), target, pterodactyl_ports, fingerprint, snapshot,
+                alias_reads.get(target)
+            ): target
+            for target in self.targets
+        }
+        done, not_done = wait(futures, timeout=self.target_deadline)
+        
+        outcomes = [future.result() for future in done]
+        for future in not_done:
+            futures[future].logger.warning("⏱️  No result within %gs - continuing without this firewall",
+                                           self.target_deadline)
+            metrics.inc('portmapper_skipped_total', target=futures[future].opnsense.name, reason='deadline')
+            outcomes.append(SYNC_ERROR)
+        return outcomes
+    
+    def _log_summary(self, outcome: str, failed: int, duration: float, snapshot: PortSnapshot,
+                     pterodactyl_ports: PortSet):
+        """One summary line per cycle; reconfigure and connection details at debug level"""
+        fields = {
+            'duration_seconds': round(duration, 3),
+            'ports': len(pterodactyl_ports),
+            'allocations': snapshot.allocation_count,
+        }
+        if len(self.targets) > 1:
+            fields['targets'] = ','.join(f"{target.opnsense.name}={target.last_outcome}" for target in self.targets)
+        if self.scheduler is not None:
+            fields['next_sync_seconds'] = round(self._schedule(outcome), 1)
+            fields['interval_reason'] = self.scheduler.reason_code
+            self._interval_logged = True
+        if outcome == SYNC_ERROR:
+            logger.warning("❌ Sync finished with errors", extra=fields)
+        elif failed:
+            logger.warning("⚠️  Sync %s, %d/%d firewall(s) failed", outcome, failed, len(self.targets), extra=fields)
         else:
-            print("❌ Error beim Aktualisieren des Alias")
+            logger.info("✅ Sync %s", outcome, extra=fields)
         
-        print("\n" + "=" * 70)
-        print(f"✅ Sync completed: {timestamp}")
-        print(f"📊 Status: {len(pterodactyl_ports)} active ports")
-        print("=" * 70)
+        if logger.isEnabledFor(logging.DEBUG):
+            for target in self.targets:
+                target.logger.debug("🔄 Reconfigure: %s", target.reconfigurer.status())
+            self._log_connection_stats()
+    
+    def _log_connection_stats(self):
+        """Log connection pool reuse for the transports in use"""
+        transports = {id(t): t for t in [self.ptero.transport] + [target.opnsense.transport for target in self.targets]}
+        for transport in transports.values():
+            logger.debug("🔌 Connections: %s", transport.pool_summary())
     
-    def run_continuous(self, interval: int = 60):
-        """Run sync continuously"""
-        print("🚀 Pterodactyl <-> OPNsense Port Mapper started")
-        print(f"⏱️  Sync interval: {interval} seconds")
-        print(f"📋 Alias Name: {self.opnsense.alias_name}")
-        print("\nPress Ctrl+C to exit...\n")
+    def run_continuous(self, interval: int = 60, trigger: SyncTrigger = None, scheduler: AdaptiveScheduler = None):
+        """Run sync continuously (periodic sweep, plus external triggers if given)"""
+        scheduler = scheduler or AdaptiveScheduler(interval)
+        self.scheduler = scheduler
+        
+        logger.info("🚀 Pterodactyl <-> OPNsense Port Mapper started")
+        if scheduler.min_interval == scheduler.max_interval:
+            logger.info("⏱️  Sync interval: %s seconds", interval)
+        else:
+            logger.info("⏱️  Sync interval: %s seconds (adaptive %g-%gs)",
+                        interval, scheduler.min_interval, scheduler.max_interval)
+        for target in self.targets:
+            logger.info("📋 Alias Name: %s @ %s", target.opnsense.alias_name, target.opnsense.name)
+        if trigger:
+            logger.info("⚡ Sync trigger enabled (debounce %ss)", trigger.debounce)
         
         try:
             while True:
                 try:
                     self.sync()
-                except Exception as e:
-                    print(f"\n❌ Error during sync: {e}")
-                    import traceback
-                    traceback.print_exc()
+                except Exception:
+                    logger.exception("❌ Error during sync")
                 
-                print(f"\n💤 Waiting {interval} seconds until next sync...")
-                time.sleep(interval)
+                # sync() has picked the interval, even if it failed; cycles that ended
+                # before the summary line get it logged here
+                delay = scheduler.interval
+                level = logging.DEBUG if self._interval_logged else logging.INFO
+                logger.log(level, "💤 Waiting %g seconds until next sync (%s)...", delay, scheduler.reason)
+                if trigger:
+                    triggers = trigger.wait(delay)
+                    if triggers:
+                        logger.info("⚡ Sync triggered (%d request(s) coalesced)", triggers)
+                else:
+                    time.sleep(delay)
                 
         except KeyboardInterrupt:
-            print("\n\n👋 Port Mapper is shutting down...")
+            logger.info("👋 Port Mapper is shutting down...")
+            busy = [target for target in self.targets if target.reconfigurer.busy]
+            if busy:
+                logger.info("⏳ Waiting for pending firewall reconfigure...")
+                for target in busy:
+                    target.reconfigurer.wait(timeout=30)
 
 
 def main():
     # Load configuration from .env
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+    try:
+        configure_logging(LOG_LEVEL, LOG_FORMAT == "json")
+    except ValueError:
+        configure_logging('INFO', LOG_FORMAT == "json")
+        logger.warning("⚠️  Unknown LOG_LEVEL %s, using INFO", LOG_LEVEL)
+    
     PTERO_URL = os.getenv("PTERODACTYL_PANEL_URL")
     PTERO_KEY = os.getenv("PTERODACTYL_API_KEY")
     
@@ -539,23 +2890,63 @@ def main():
     OPNSENSE_SECRET = os.getenv("OPNSENSE_API_SECRET")
     OPNSENSE_VERIFY_SSL = os.getenv("OPNSENSE_VERIFY_SSL", "true").lower() == "true"
     
+    OPNSENSE_TIMEOUT = os.getenv("OPNSENSE_TIMEOUT", "")
+    
     ALIAS_NAME = os.getenv("ALIAS_NAME", "pterodactyl_ports")
+    ALIAS_CACHE_TTL = float(os.getenv("ALIAS_CACHE_TTL", "300"))
+    ALIAS_PORT_RANGES = os.getenv("ALIAS_PORT_RANGES", "true").lower() == "true"
+    ALIAS_SHARDS = int(os.getenv("ALIAS_SHARDS", "0"))
+    ALIAS_GROUP_BY = os.getenv("ALIAS_GROUP_BY", "").lower()
     SYNC_INTERVAL = int(os.getenv("SYNC_INTERVAL", "60"))
+    SYNC_INTERVAL_MIN = float(os.getenv("SYNC_INTERVAL_MIN") or SYNC_INTERVAL)
+    SYNC_INTERVAL_MAX = float(os.getenv("SYNC_INTERVAL_MAX") or SYNC_INTERVAL)
+    VERIFY_EVERY = int(os.getenv("VERIFY_EVERY", "10"))
+    RECONFIGURE_ASYNC = os.getenv("RECONFIGURE_ASYNC", "true").lower() == "true"
+    TARGET_DEADLINE = float(os.getenv("TARGET_DEADLINE", "120"))
+    PTERODACTYL_FETCH_DEADLINE = float(os.getenv("PTERODACTYL_FETCH_DEADLINE", "120"))
+    OPNSENSE_READ_DEADLINE = float(os.getenv("OPNSENSE_READ_DEADLINE", "30"))
+    CIRCUIT_BREAKER_THRESHOLD = int(os.getenv("CIRCUIT_BREAKER_THRESHOLD", "3"))
+    CIRCUIT_BREAKER_COOLDOWN = float(os.getenv("CIRCUIT_BREAKER_COOLDOWN", "60"))
+    
+    STATE_FILE = os.getenv("STATE_FILE", "")
+    STATE_MAX_AGE = float(os.getenv("STATE_MAX_AGE", "3600"))
+    
+    TRIGGER_LISTEN = os.getenv("TRIGGER_LISTEN", "")
+    TRIGGER_TOKEN = os.getenv("TRIGGER_TOKEN", "")
+    TRIGGER_DEBOUNCE = float(os.getenv("TRIGGER_DEBOUNCE", "2"))
+    
+    METRICS_LISTEN = os.getenv("METRICS_LISTEN", "")
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+    
+    TRACE_FILE = os.getenv("TRACE_FILE", "")
+    PROFILE_EVERY = int(os.getenv("PROFILE_EVERY", "0"))
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+    PROFILE_MODE = os.getenv("PROFILE_MODE", "sample").lower()
+    PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+    
+    PTERODACTYL_PAGE_WORKERS = int(os.getenv("PTERODACTYL_PAGE_WORKERS", "4"))
+    PTERODACTYL_FETCH_MODE = os.getenv("PTERODACTYL_FETCH_MODE", "servers").lower()
+    PTERODACTYL_RATE_LIMIT = float(os.getenv("PTERODACTYL_RATE_LIMIT", "0"))
+    
+    HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+    HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+    HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+    HTTP_MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", "4"))
     
     # Parse EXCLUDED_PORTS from .env (comma-separated list)
     excluded_ports_str = os.getenv("EXCLUDED_PORTS", "")
-    excluded_ports = set()
+    excluded_ports = PortSet()
     if excluded_ports_str:
         try:
-            excluded_ports = {int(p.strip()) for p in excluded_ports_str.split(',') if p.strip()}
+            excluded_ports = PortSet(int(p.strip()) for p in excluded_ports_str.split(',') if p.strip())
             if excluded_ports:
-                print(f"🔒 Protected ports: {sorted(excluded_ports)}")
+                logger.info("🔒 Protected ports: %s", PortList(excluded_ports, limit=0))
         except ValueError:
-            print("⚠️  Warning: EXCLUDED_PORTS contains invalid values, will be ignored")
+            logger.warning("⚠️  EXCLUDED_PORTS contains invalid values, will be ignored")
     
     # Validation
     if not all([PTERO_URL, PTERO_KEY, OPNSENSE_URL, OPNSENSE_KEY, OPNSENSE_SECRET]):
-        print("❌ Error: Not all required environment variables set!")
+        logger.error("❌ Not all required environment variables set!")
         print("\nRequired in .env:")
         print("  - PTERODACTYL_PANEL_URL")
         print("  - PTERODACTYL_API_KEY")
@@ -564,18 +2955,147 @@ def main():
         print("  - OPNSENSE_API_SECRET")
         print("\nOptional:")
         print("  - ALIAS_NAME (default: pterodactyl_ports)")
+        print("  - ALIAS_CACHE_TTL (default: 300 seconds, 0 disables)")
+        print("  - ALIAS_PORT_RANGES (default: true, write contiguous ports as start:end)")
+        print("  - ALIAS_SHARDS (default: 0, split the alias into N nested aliases by port range)")
+        print("  - ALIAS_GROUP_BY (node or ip, one alias per Pterodactyl node or allocation IP)")
         print("  - SYNC_INTERVAL (default: 60)")
+        print("  - SYNC_INTERVAL_MIN / SYNC_INTERVAL_MAX (default: SYNC_INTERVAL, adaptive interval bounds)")
+        print("  - VERIFY_EVERY (default: 10, read the alias at least every N cycles)")
+        print("  - RECONFIGURE_ASYNC (default: true, don't block the sync on reconfigure)")
         print("  - OPNSENSE_VERIFY_SSL (default: true)")
+        print("  - OPNSENSE_TIMEOUT (read timeout in seconds, default: HTTP_READ_TIMEOUT)")
+        print("  - OPNSENSE_2_URL, OPNSENSE_2_API_KEY, ... (additional firewalls, see README)")
+        print("  - TARGET_DEADLINE (default: 120 seconds per firewall and cycle)")
+        print("  - PTERODACTYL_FETCH_DEADLINE / OPNSENSE_READ_DEADLINE (default: 120 / 30 seconds)")
+        print("  - CIRCUIT_BREAKER_THRESHOLD (default: 3 failed cycles before an upstream is paused)")
+        print("  - CIRCUIT_BREAKER_COOLDOWN (default: 60 seconds)")
+        print("  - STATE_FILE (e.g. /app/data/state.json, enables warm restarts)")
+        print("  - STATE_MAX_AGE (default: 3600 seconds, older state files are ignored)")
         print("  - EXCLUDED_PORTS (comma-separated, e.g. 22,80,443)")
+        print("  - TRIGGER_LISTEN (e.g. 127.0.0.1:8787, enables POST /sync)")
+        print("  - TRIGGER_TOKEN (optional bearer token for the trigger endpoint)")
+        print("  - TRIGGER_DEBOUNCE (default: 2 seconds)")
+        print("  - METRICS_LISTEN (e.g. 0.0.0.0:9187, enables GET /metrics for Prometheus)")
+        print("  - METRICS_TOKEN (optional bearer token for the metrics endpoint)")
+        print("  - TRACE_FILE (e.g. /app/data/trace.jsonl or - for stdout, one JSON timing line per cycle)")
+        print("  - PROFILE_EVERY (default: 0, profile every Nth cycle)")
+        print("  - PROFILE_DIR / PROFILE_MODE / PROFILE_KEEP (default: profiles / sample / 20 files)")
+        print("  - PTERODACTYL_PAGE_WORKERS (default: 4 concurrent page fetches)")
+        print("  - PTERODACTYL_FETCH_MODE (servers or nodes, default: servers)")
+        print("  - PTERODACTYL_RATE_LIMIT (requests per minute, default: 0 = learn from the panel)")
+        print("  - HTTP_CONNECT_TIMEOUT / HTTP_READ_TIMEOUT (default: 5 / 30 seconds)")
+        print("  - HTTP_MAX_RETRIES (default: 3, idempotent requests only)")
+        print("  - HTTP_MAX_PER_HOST (default: 4 concurrent requests per host)")
+        print("  - LOG_LEVEL (default: INFO, DEBUG logs full port lists)")
+        print("  - LOG_FORMAT (text or json, default: text)")
         return
     
-    # Initialize APIs
-    ptero_api = PterodactylAPI(PTERO_URL, PTERO_KEY)
-    opnsense_api = OPNsenseAPI(OPNSENSE_URL, OPNSENSE_KEY, OPNSENSE_SECRET, ALIAS_NAME, OPNSENSE_VERIFY_SSL)
+    # Initialize APIs (sharing one pooled transport)
+    transport = HttpTransport(
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=HTTP_READ_TIMEOUT,
+        max_retries=HTTP_MAX_RETRIES,
+        max_per_host=HTTP_MAX_PER_HOST
+    )
+    try:
+        ptero_api = PterodactylAPI(
+            PTERO_URL, PTERO_KEY, transport, PTERODACTYL_PAGE_WORKERS, PTERODACTYL_FETCH_MODE,
+            RateLimiter(PTERODACTYL_RATE_LIMIT)
+        )
+    except ValueError as e:
+        logger.error("❌ %s", e)
+        return
+    # With ALIAS_SHARDS the alias only nests <ALIAS_NAME>_1..N, which hold the ports
+    # With ALIAS_GROUP_BY the ports go to <ALIAS_NAME>_<node or IP> aliases instead
+    opnsense_class, shard_options = OPNsenseAPI, {}
+    if ALIAS_GROUP_BY and ALIAS_SHARDS > 1:
+        logger.warning("⚠️  ALIAS_SHARDS is ignored with ALIAS_GROUP_BY")
+    elif ALIAS_SHARDS > 1:
+        opnsense_class, shard_options = ShardedOPNsenseAPI, {'shards': ALIAS_SHARDS}
+    opnsense_apis = [
+        opnsense_class(
+            OPNSENSE_URL, OPNSENSE_KEY, OPNSENSE_SECRET, ALIAS_NAME, OPNSENSE_VERIFY_SSL,
+            transport, ALIAS_CACHE_TTL, ALIAS_PORT_RANGES,
+            timeout=(HTTP_CONNECT_TIMEOUT, float(OPNSENSE_TIMEOUT)) if OPNSENSE_TIMEOUT else None,
+            name=os.getenv("OPNSENSE_NAME", ""), **shard_options
+        )
+    ]
+    
+    # Additional firewalls: OPNSENSE_2_URL, OPNSENSE_3_URL, ... (same keys with a number)
+    index = 2
+    while os.getenv(f"OPNSENSE_{index}_URL"):
+        prefix = f"OPNSENSE_{index}_"
+        key = os.getenv(prefix + "API_KEY")
+        secret = os.getenv(prefix + "API_SECRET")
+        if not key or not secret:
+            logger.error("❌ %sAPI_KEY and %sAPI_SECRET are required for %sURL", prefix, prefix, prefix)
+            return
+        timeout = os.getenv(prefix + "TIMEOUT", OPNSENSE_TIMEOUT)
+        opnsense_apis.append(opnsense_class(
+            os.getenv(prefix + "URL"), key, secret,
+            os.getenv(prefix + "ALIAS_NAME", ALIAS_NAME),
+            os.getenv(prefix + "VERIFY_SSL", str(OPNSENSE_VERIFY_SSL)).lower() == "true",
+            transport, ALIAS_CACHE_TTL, ALIAS_PORT_RANGES,
+            timeout=(HTTP_CONNECT_TIMEOUT, float(timeout)) if timeout else None,
+            name=os.getenv(prefix + "NAME", ""), **shard_options
+        ))
+        index += 1
+    
+    # Optional HTTP trigger endpoint
+    trigger = None
+    control = None
+    if TRIGGER_LISTEN:
+        trigger = SyncTrigger(debounce=TRIGGER_DEBOUNCE, max_delay=TRIGGER_DEBOUNCE * 5)
+        host, port = parse_listen_address(TRIGGER_LISTEN)
+        control = ControlServer(host, port, TRIGGER_TOKEN)
+        control.add_route('POST', '/sync', trigger.handle_request)
+        control.start()
+        logger.info("⚡ Trigger endpoint: POST http://%s:%s/sync", host, control.port)
+    
+    # Optional metrics endpoint (shares the trigger server if it uses the same address)
+    if METRICS_LISTEN:
+        host, port = parse_listen_address(METRICS_LISTEN)
+        if control and (control.host, control.port) == (host, port):
+            control.add_route('GET', '/metrics', metrics.handle_request)
+        else:
+            metrics_server = ControlServer(host, port, METRICS_TOKEN)
+            metrics_server.add_route('GET', '/metrics', metrics.handle_request)
+            metrics_server.start()
+            port = metrics_server.port
+        logger.info("📈 Metrics endpoint: GET http://%s:%s/metrics", host, port)
+    
+    # Optional cycle tracing and profiling
+    if TRACE_FILE:
+        try:
+            tracer.open(TRACE_FILE)
+        except OSError as e:
+            logger.error("❌ Cannot open TRACE_FILE: %s", e)
+            return
+        logger.info("⏱️  Cycle timings: %s", 'stdout' if TRACE_FILE == '-' else TRACE_FILE)
+    if PROFILE_EVERY > 0:
+        try:
+            profiler.configure(PROFILE_EVERY, PROFILE_DIR, PROFILE_MODE, PROFILE_KEEP)
+        except (OSError, ValueError) as e:
+            logger.error("❌ %s", e)
+            return
+        logger.info("🔬 Profiling every %d cycles (%s) into %s", PROFILE_EVERY, PROFILE_MODE, PROFILE_DIR)
     
     # Start sync
-    sync_manager = PortMapperSync(ptero_api, opnsense_api, excluded_ports)
-    sync_manager.run_continuous(SYNC_INTERVAL)
+    state_store = StateStore(STATE_FILE, STATE_MAX_AGE) if STATE_FILE else None
+    try:
+        sync_manager = PortMapperSync(
+            ptero_api, opnsense_apis, excluded_ports, VERIFY_EVERY, RECONFIGURE_ASYNC, TARGET_DEADLINE,
+            state_store, PTERODACTYL_FETCH_DEADLINE, OPNSENSE_READ_DEADLINE, CIRCUIT_BREAKER_THRESHOLD,
+            CIRCUIT_BREAKER_COOLDOWN, ALIAS_GROUP_BY
+        )
+    except ValueError as e:
+        logger.error("❌ %s", e)
+        return
+    if state_store:
+        sync_manager.restore_state(state_store.load())
+    scheduler = AdaptiveScheduler(SYNC_INTERVAL, SYNC_INTERVAL_MIN, SYNC_INTERVAL_MAX)
+    sync_manager.run_continuous(SYNC_INTERVAL, trigger, scheduler)
 
 
 if __name__ == "__main__":